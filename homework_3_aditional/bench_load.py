@@ -0,0 +1,339 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+import requests
+
+# Load and latency benchmark for the replicated log. Starts a master and its secondaries as local processes
+# (no Docker), drives a write/read mix for every combination of w, message size and concurrency, and appends
+# one JSON line per scenario to the results file, so runs of different implementations can be compared.
+# Usage: python bench_load.py --impl homework_2 homework_3 homework_3_aditional --w 1 2 3 --concurrency 1 8
+# A master script other than master.py is picked with a suffix, e.g. --impl homework_3_aditional:master_async.py
+# Implementations with a replica server start --replicas of them (default 2), on ports 5001 and up.
+# --serving production runs those nodes through serving.py (gunicorn or pooled werkzeug, tuned aiohttp) instead of app.run().
+
+here = os.path.dirname(os.path.abspath(__file__))
+repo_root = os.path.dirname(here)
+master_url = 'http://127.0.0.1:5000'
+secondary_urls = ['http://127.0.0.1:5001', 'http://127.0.0.1:5002']  # For implementations with fixed secondary scripts
+
+# How each implementation runs locally. The staged copy gets the listed source rewrites: the docker-compose
+# hostnames become 127.0.0.1, and simulated replica delays of many seconds and random drops are switched off.
+IMPLEMENTATIONS = {
+    'homework_2': {
+        'master': 'master.py',
+        'secondaries': ['secondary_1.py', 'secondary_2.py'],
+        'write_path': '/messages',
+        'lag_probe': 'messages',  # Secondary progress is only visible as the length of GET /messages
+        'rewrites': {
+            'master.py': [("http://secondary_1:5001", "http://127.0.0.1:5001"),
+                          ("http://secondary_2:5002", "http://127.0.0.1:5002")],
+            'secondary_1.py': [("delay_time= [30,60,90,120]", "delay_time= [0]")],
+        },
+        'env': {},
+    },
+    'homework_3': {
+        'master': 'master.py',
+        'secondaries': ['secondary_1.py', 'secondary_2.py'],
+        'write_path': '/replicate',
+        'lag_probe': 'messages',
+        'rewrites': {
+            'master.py': [("http://secondary1:5001", "http://127.0.0.1:5001"),
+                          ("http://secondary2:5002", "http://127.0.0.1:5002")],
+            'secondary_1.py': [("delay_time = [10, 15, 20, 30]", "delay_time = [0]"),
+                               ("missed_request_chance = 0.2", "missed_request_chance = 0.0")],
+        },
+        'env': {},
+    },
+    'homework_3_aditional': {
+        'master': 'master.py',
+        'replica': 'replica.py',  # Every secondary is this script on its own port, so any number can be started
+        'write_path': '/replicate',
+        'lag_probe': 'heartbeat',  # /heartbeat reports the contiguous id
+        'rewrites': {},
+        'env': {
+            'MASTER_URL': master_url,
+            'FAULT_DELAYS': '',
+            'FAULT_DROP_CHANCE': '0',
+        },
+    },
+}
+
+
+def percentiles(samples):
+    """Nearest-rank p50/p95/p99/p999 and max of latencies in seconds, reported in milliseconds."""
+    if not samples:
+        return {}
+    samples = sorted(samples)
+    result = {}
+    for name, q in (('p50_ms', 0.5), ('p95_ms', 0.95), ('p99_ms', 0.99), ('p999_ms', 0.999)):
+        result[name] = round(samples[min(int(q * len(samples)), len(samples) - 1)] * 1000, 3)
+    result['max_ms'] = round(samples[-1] * 1000, 3)
+    return result
+
+
+def port_in_use(url):
+    host, port = url.rsplit('/', 1)[-1].split(':')
+    with socket.socket() as sock:
+        return sock.connect_ex((host, int(port))) == 0
+
+
+class LocalCluster:
+    """A staged copy of one implementation with its master and secondaries running as child processes."""
+
+    def __init__(self, name, master=None, env=None, replicas=2, serving='dev'):
+        self.name = name
+        self.profile = IMPLEMENTATIONS[name]
+        self.master = master or self.profile['master']
+        self.serving = serving if 'replica' in self.profile else 'dev'  # Only the replica-server layout has serving.py
+        self.env = dict(os.environ, **self.profile['env'], **(env or {}))
+        if 'replica' in self.profile:
+            self.secondary_urls = [f'http://127.0.0.1:{5001 + i}' for i in range(replicas)]
+            self.env['SECONDARIES'] = ','.join(self.secondary_urls)
+        else:
+            self.secondary_urls = secondary_urls[:len(self.profile['secondaries'])]
+        self.workdir = None
+        self.processes = []
+
+    def __enter__(self):
+        self.stage()
+        try:
+            self.start()
+        except Exception:
+            self.stop()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stage(self):
+        """Copy the implementation to a fresh directory, without logs or data, and apply its rewrites."""
+        self.workdir = tempfile.mkdtemp(prefix=f'bench-{self.name}-')
+        source = os.path.join(repo_root, self.name)
+        shutil.copytree(source, self.workdir, dirs_exist_ok=True,
+                        ignore=shutil.ignore_patterns('*.log', '*.log.*', '*.wal', '*_data', '__pycache__'))
+        for filename, rewrites in self.profile['rewrites'].items():
+            path = os.path.join(self.workdir, filename)
+            with open(path) as f:
+                code = f.read()
+            for old, new in rewrites:
+                if old not in code:
+                    raise RuntimeError(f"{self.name}/{filename} no longer contains {old!r}; update its rewrites")
+                code = code.replace(old, new)
+            with open(path, 'w') as f:
+                f.write(code)
+
+    def spawn(self, command, url):
+        script = command[0]
+        if port_in_use(url):
+            raise RuntimeError(f"{url} is already in use; stop whatever listens there first")
+        output = open(os.path.join(self.workdir, f"{script}.{url.rsplit(':', 1)[1]}.out"), 'w')
+        # Own process group, so stop() also reaches anything the script forks (cluster workers)
+        process = subprocess.Popen([sys.executable, *command], cwd=self.workdir, env=self.env,
+                                   stdout=output, stderr=subprocess.STDOUT, start_new_session=True)
+        self.processes.append(process)
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{script} exited with {process.returncode}; see {output.name}")
+            try:
+                if requests.get(f'{url}/messages', timeout=1).status_code == 200:
+                    return
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(0.1)
+        raise RuntimeError(f"{script} did not answer on {url} within 30 seconds")
+
+    def start(self):
+        production = self.serving == 'production'
+        if 'replica' in self.profile:
+            replica = ['serving.py', 'replica'] if production else [self.profile['replica']]
+            commands = [replica + ['--port', url.rsplit(':', 1)[1]] for url in self.secondary_urls]
+        else:
+            commands = [[script] for script in self.profile['secondaries']]
+        for command, url in zip(commands, self.secondary_urls):
+            self.spawn(command, url)
+        node = self.master[:-len('.py')]
+        self.spawn(['serving.py', node] if production and node in ('master', 'master_async') else [self.master], master_url)
+
+    @staticmethod
+    def send_signal(process, signum):
+        try:
+            os.killpg(process.pid, signum)
+        except ProcessLookupError:
+            pass  # Already gone
+
+    def stop(self):
+        for process in self.processes:
+            self.send_signal(process, signal.SIGTERM)
+        for process in self.processes:
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.send_signal(process, signal.SIGKILL)
+        self.processes = []
+        if self.workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+            self.workdir = None
+
+    def secondary_progress(self, session, url):
+        """Number of messages a secondary holds in order, or None if it did not answer."""
+        try:
+            if self.profile['lag_probe'] == 'heartbeat':
+                return session.get(f'{url}/heartbeat', timeout=5).json()['contiguous_id']
+            return len(session.get(f'{url}/messages', timeout=30).json()['messages'])
+        except (requests.exceptions.RequestException, ValueError, KeyError):
+            return None
+
+
+def run_scenario(cluster, w, message_size, concurrency, total, read_ratio, read_from, lag_interval):
+    """Closed-loop load: concurrency clients issue total requests back to back. Returns the result record."""
+    write_path = cluster.profile['write_path']
+    read_urls = cluster.secondary_urls if read_from == 'secondaries' else [master_url]
+    payload = 'x' * message_size
+    operations = itertools.count()
+    write_latencies, read_latencies = [], []
+    errors = {'write': 0, 'read': 0}
+    written = [0]  # Acknowledged writes so far
+    lock = threading.Lock()
+
+    def client(seed):
+        rng = random.Random(seed)
+        session = requests.Session()
+        while next(operations) < total:
+            is_read = rng.random() < read_ratio
+            started = time.perf_counter()
+            try:
+                if is_read:
+                    since_id = max(written[0] - 100, 0)
+                    url = rng.choice(read_urls)
+                    ok = session.get(f'{url}/messages', params={'since_id': since_id, 'limit': 100}, timeout=30).status_code == 200
+                else:
+                    ok = session.post(f'{master_url}{write_path}', json={'message': payload, 'w': w}, timeout=30).status_code == 200
+            except requests.exceptions.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                kind = 'read' if is_read else 'write'
+                if not ok:
+                    errors[kind] += 1
+                elif is_read:
+                    read_latencies.append(elapsed)
+                else:
+                    write_latencies.append(elapsed)
+                    written[0] += 1
+
+    lag_samples = []
+    load_done = threading.Event()
+
+    def sample_lag():
+        session = requests.Session()
+        while not load_done.wait(lag_interval):
+            for url in cluster.secondary_urls:
+                progress = cluster.secondary_progress(session, url)
+                if progress is not None:
+                    lag_samples.append(max(written[0] - progress, 0))
+
+    sampler = threading.Thread(target=sample_lag, daemon=True)
+    sampler.start()
+    started = time.perf_counter()
+    clients = [threading.Thread(target=client, args=(seed,)) for seed in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    duration = time.perf_counter() - started
+    load_done.set()
+    sampler.join()
+
+    # Replication lag at the end of the load: how long until every secondary holds every acknowledged write
+    session = requests.Session()
+    drain_started = time.perf_counter()
+    drain = None
+    while time.perf_counter() - drain_started < 60:
+        progress = [cluster.secondary_progress(session, url) for url in cluster.secondary_urls]
+        if all(p is not None and p >= written[0] for p in progress):
+            drain = round(time.perf_counter() - drain_started, 3)
+            break
+        time.sleep(0.05)
+
+    return {
+        'implementation': cluster.name,
+        'master': cluster.master,
+        'secondaries': len(cluster.secondary_urls),
+        'serving': cluster.serving,
+        'w': w,
+        'message_size': message_size,
+        'concurrency': concurrency,
+        'read_ratio': read_ratio,
+        'read_from': read_from,
+        'requests': total,
+        'duration_s': round(duration, 3),
+        'throughput_rps': round((len(write_latencies) + len(read_latencies)) / duration, 1),
+        'writes': {'ok': len(write_latencies), 'errors': errors['write'], **percentiles(write_latencies)},
+        'reads': {'ok': len(read_latencies), 'errors': errors['read'], **percentiles(read_latencies)},
+        'lag': {
+            'max_entries': max(lag_samples) if lag_samples else None,
+            'mean_entries': round(sum(lag_samples) / len(lag_samples), 1) if lag_samples else None,
+            'drain_s': drain  # None if the secondaries did not catch up within 60 seconds
+        },
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=repo_root, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load and latency benchmark for the replicated log')
+    parser.add_argument('--impl', nargs='+', default=list(IMPLEMENTATIONS),
+                        help='implementations to run, optionally name:master_script')
+    parser.add_argument('--w', nargs='+', type=int, default=[1, 2, 3], help='write concerns')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[64], help='message sizes in bytes')
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 8], help='concurrent clients')
+    parser.add_argument('--requests', type=int, default=500, help='requests per scenario')
+    parser.add_argument('--read-ratio', type=float, default=0.0, help='fraction of requests that are reads')
+    parser.add_argument('--read-from', choices=['master', 'secondaries'], default='master')
+    parser.add_argument('--replicas', type=int, default=2,
+                        help='secondaries to start for implementations with a replica server')
+    parser.add_argument('--serving', choices=['dev', 'production'], default='dev',
+                        help="production: serve the nodes through serving.py (replica-server implementations only)")
+    parser.add_argument('--lag-interval', type=float, default=0.5, help='seconds between replication lag samples')
+    parser.add_argument('--out', default='bench_results.jsonl', help='JSON lines file the results are appended to')
+    args = parser.parse_args()
+
+    run = {'run_at': datetime.now().isoformat(), 'revision': git_revision()}
+    with open(args.out, 'a') as out:
+        for spec in args.impl:
+            name, _, master = spec.partition(':')
+            for w, size, concurrency in itertools.product(args.w, args.sizes, args.concurrency):
+                # A fresh cluster per scenario, so earlier messages never slow down the next one
+                with LocalCluster(name, master or None, replicas=args.replicas, serving=args.serving) as cluster:
+                    result = run_scenario(cluster, w, size, concurrency, args.requests, args.read_ratio,
+                                          args.read_from, args.lag_interval)
+                result.update(run)
+                out.write(json.dumps(result) + '\n')
+                out.flush()
+                writes = result['writes']
+                print(f"{spec:<36} {cluster.serving:<10} n={len(cluster.secondary_urls):<3} w={w} size={size:<6} c={concurrency:<4} {result['throughput_rps']:>8} req/s  "
+                      f"write p50 {writes.get('p50_ms')} p99 {writes.get('p99_ms')} p999 {writes.get('p999_ms')} ms  "
+                      f"errors {writes['errors'] + result['reads']['errors']}  drain {result['lag']['drain_s']} s")
+
+
+if __name__ == '__main__':
+    main()
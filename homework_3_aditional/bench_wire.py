@@ -0,0 +1,49 @@
+import json
+import sys
+import timeit
+from datetime import datetime
+import wire
+
+# Encode/decode cost per message of a /replicate_batch body, JSON vs the binary framing.
+# Usage: python bench_wire.py [message size in bytes]
+message_size = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+batch_sizes = [1, 10, 100, 1000]
+
+
+def make_batch(size):
+    timestamp = datetime.now().isoformat()
+    return [{'id': 1000000 + i, 'message': 'x' * message_size, 'timestamp': timestamp} for i in range(size)]
+
+
+def per_message_us(fn, batch_size):
+    """Best of 5 runs, in microseconds per message."""
+    number = max(1, 20000 // batch_size)
+    return min(timeit.repeat(fn, number=number, repeat=5)) / (number * batch_size) * 1e6
+
+
+def bench(batch_size):
+    batch = make_batch(batch_size)
+    json_body = json.dumps({'messages': batch}, separators=(',', ':')).encode()
+    binary_body = wire.encode_batch(batch)
+    acks = [entry['id'] for entry in batch]
+    return {
+        'batch': batch_size,
+        'json_encode': per_message_us(lambda: json.dumps({'messages': batch}, separators=(',', ':')).encode(), batch_size),
+        'json_decode': per_message_us(lambda: json.loads(json_body)['messages'], batch_size),
+        'binary_encode': per_message_us(lambda: wire.encode_batch(batch), batch_size),
+        'binary_decode': per_message_us(lambda: wire.decode_batch(binary_body), batch_size),
+        'json_bytes': len(json_body) / batch_size,
+        'binary_bytes': len(binary_body) / batch_size,
+        'json_acks_bytes': len(json.dumps({'status': 'Batch replicated', 'acks': acks})) / batch_size,
+        'binary_acks_bytes': len(wire.encode_acks(acks)) / batch_size,
+    }
+
+
+if __name__ == '__main__':
+    print(f"message size {message_size} bytes; costs in microseconds per message, sizes in bytes per message")
+    columns = ['batch', 'json_encode', 'json_decode', 'binary_encode', 'binary_decode',
+               'json_bytes', 'binary_bytes', 'json_acks_bytes', 'binary_acks_bytes']
+    print(' '.join(f'{column:>17}' for column in columns))
+    for batch_size in batch_sizes:
+        row = bench(batch_size)
+        print(' '.join(f'{row[column]:>17.2f}' if isinstance(row[column], float) else f'{row[column]:>17}' for column in columns))
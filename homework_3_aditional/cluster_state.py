@@ -0,0 +1,441 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from latency import ReplicaLatencies
+from membership import parse_member_url, parse_write_concern, derived_quorum
+from metrics import Registry
+from replication import run_callback
+
+# State and policy shared by the threaded and the asyncio master: membership and quorum, the progress
+# of each secondary and the catch-up decisions built on it, parked acks, recent write concerns and
+# hedging. Each master keeps only its I/O: HTTP handlers, the replication transport, threads or tasks.
+
+# Secondary base URLs, the initial membership; SECONDARIES (comma-separated) replaces the docker-compose hostnames.
+# Secondaries join and leave at runtime through POST / DELETE /secondaries.
+secondary_urls = [url.strip() for url in os.environ.get('SECONDARIES', 'http://secondary1:5001,http://secondary2:5002').split(',') if url.strip()]
+heartbeat_interval = 10  # Heartbeat interval in seconds
+heartbeat_timeout = 3  # Timeout for heartbeat requests
+phi_suspect_threshold = float(os.environ.get('PHI_SUSPECT_THRESHOLD', 1))  # Suspicion level at which a node is Suspected
+phi_failure_threshold = float(os.environ.get('PHI_FAILURE_THRESHOLD', 3))  # Suspicion level at which a node is Unhealthy
+quorum_override = int(os.environ['QUORUM_SIZE']) if os.environ.get('QUORUM_SIZE') else None  # Fixed quorum instead of a majority
+
+# Batched replication stream settings
+replication_batch_size = int(os.environ.get('REPLICATION_BATCH_SIZE', 100))  # Max messages per batch
+replication_linger = float(os.environ.get('REPLICATION_LINGER', 0.01))  # Max seconds to wait for a batch to fill
+replication_in_flight = int(os.environ.get('REPLICATION_IN_FLIGHT', 2))  # Concurrent batches per secondary
+replication_retries = int(os.environ.get('REPLICATION_RETRIES', 3))  # Live-stream attempts before catch-up takes over
+replication_queue_size = int(os.environ.get('REPLICATION_QUEUE_SIZE', 10000))  # Entries buffered per secondary
+replication_enqueue_timeout = float(os.environ.get('REPLICATION_ENQUEUE_TIMEOUT', 1))  # Seconds a write waits for room
+replication_wire_format = os.environ.get('REPLICATION_WIRE_FORMAT', 'binary')  # 'binary' framing or 'json' batches
+
+# Latency-aware write concern
+write_deadline = float(os.environ.get('WRITE_DEADLINE', 10))  # Default max seconds a write waits for w acks (wtimeout)
+write_ack_mode = os.environ.get('WRITE_ACK_MODE', 'any')  # 'any' counts whichever acks arrive; 'fastest' also hedges slow replicas
+hedge_percentile = float(os.environ.get('HEDGE_PERCENTILE', 0.95))  # A replica slower than this percentile of its own round trips gets hedged
+write_history_size = int(os.environ.get('WRITE_HISTORY_SIZE', 10000))  # Recent writes whose acks GET /writes/<id> reports
+
+# Catch-up of lagging or restarted secondaries from the master log
+catchup_batch_size = int(os.environ.get('CATCHUP_BATCH_SIZE', 1000))  # Entries per bulk catch-up request
+
+# Metrics served at GET /metrics. Queue depths, retry counts, lag and phi are read at scrape time.
+metrics = Registry()
+write_latency = metrics.histogram('write_latency_seconds', 'Time from receiving a write to answering it', ['w'])
+writes_answered = metrics.counter('writes_total', 'Answered writes by write concern and commit status', ['w', 'commit'])
+replication_rtt = metrics.histogram('replication_rtt_seconds', 'Round trip of one /replicate_batch request', ['secondary'])
+hedges_sent = metrics.counter('write_hedges_total', 'Entries sent straight to a secondary because a replica was slow', ['secondary'])
+heartbeat_results = metrics.counter('heartbeats_total', 'Heartbeat probes by outcome', ['secondary', 'outcome'])
+lock_wait = metrics.histogram('lock_wait_seconds', 'Time spent waiting to acquire a lock', ['lock'])
+
+
+def parse_write_request(data, members):
+    """Read a POST /replicate body: (message, w, ack_mode, timeout in seconds). Raises ValueError on bad input.
+
+    w is the write concern; wtimeout (milliseconds) or deadline (seconds) caps the wait for it, and
+    ack_mode 'fastest' counts on the fastest healthy replicas and hedges slow ones.
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Request body must be a JSON object')
+    message = data.get('message')
+    if not message:
+        raise ValueError('No message provided')
+    ack_mode = data.get('ack_mode') or write_ack_mode
+    if ack_mode not in ('any', 'fastest'):
+        raise ValueError("ack_mode must be 'any' or 'fastest'")
+    w = parse_write_concern(data.get('w', 1), members)
+    try:
+        if data.get('wtimeout') is not None:
+            timeout = float(data['wtimeout']) / 1000
+        else:
+            timeout = write_deadline if data.get('deadline') is None else float(data['deadline'])
+    except (TypeError, ValueError):
+        raise ValueError('wtimeout must be a number of milliseconds')
+    return message, w, ack_mode, timeout
+
+
+def time_left(expires, cap=None):
+    """Seconds until expires, at most cap."""
+    left = max(expires - time.monotonic(), 0)
+    return left if cap is None else min(left, cap)
+
+
+class WriteConcern:
+    """Counts the acknowledgments of one write, at most one per node, and sets done once w of them are in."""
+
+    def __init__(self, required):
+        self.required = required
+        self.acked_by = set()  # 'master' once its write is durable, then secondary urls
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+
+    def ack(self, node):
+        with self.lock:
+            self.acked_by.add(node)  # The live stream, a hedge and catch-up may all ack the same node
+            if len(self.acked_by) >= self.required:
+                self._set_done()
+
+    def _set_done(self):
+        self.done.set()
+
+    def is_met(self):
+        return self.done.is_set()
+
+    @property
+    def count(self):
+        return len(self.acked_by)
+
+    def report(self):
+        """Commit status and the nodes that acknowledged so far."""
+        with self.lock:
+            acked_by = sorted(self.acked_by)
+        return {'commit': 'committed' if self.is_met() else 'pending', 'acked_by': acked_by,
+                'acks': len(acked_by), 'write_concern': self.required}
+
+
+class AsyncWriteConcern(WriteConcern):
+    """Event-loop version: done is a future, so ack() must run on the loop that created it."""
+
+    def __init__(self, required):
+        super().__init__(required)
+        self.done = asyncio.get_running_loop().create_future()
+
+    def _set_done(self):
+        if not self.done.done():
+            self.done.set_result(len(self.acked_by))
+
+    def is_met(self):
+        return self.done.done()
+
+
+class ClusterState:
+    """Membership, quorum and per-secondary progress of a master, and the policy decisions made on them.
+
+    last_id() returns the master's highest id. The master attaches its heartbeat scheduler as heartbeats
+    and carries out what the decisions call for, such as the catch-up ranges note_progress() returns.
+    Safe to call from any thread; ack callbacks always run outside the lock.
+    """
+
+    def __init__(self, urls, last_id, log):
+        self.secondaries = {url: "Healthy" for url in urls}  # url -> Healthy / Suspected / Unhealthy
+        self.last_id = last_id
+        self.log = log
+        self.quorum_size = derived_quorum(len(self.secondaries), quorum_override)  # Required number of healthy secondaries for quorum
+        self.read_only = False  # Set while the quorum is not met
+        self.heartbeats = None  # The master's heartbeat scheduler, attached once it exists
+        self.lock = threading.RLock()  # Serializes joins, leaves, status updates and the bookkeeping below
+
+        self.senders = {}  # secondary_url -> replication sender, started on first use
+        self.latencies = ReplicaLatencies()  # Round-trip EWMA and percentiles per secondary
+        self.wire_formats = {}  # secondary_url -> 'json' for secondaries that rejected the binary framing
+        self.write_concerns = OrderedDict()  # message id -> WriteConcern of the most recent writes, oldest first
+
+        # Catch-up of lagging or restarted secondaries
+        self.catchup_horizon = {}  # secondary_url -> last master id seen at the previous heartbeat
+        self.catchups_running = set()  # Secondaries with a catch-up in progress
+        self.parked_acks = {}  # secondary_url -> {message_id: [on_ack]} for entries the live stream did not deliver
+
+        # Progress of each secondary, reported by heartbeat answers and by replication acks
+        self.last_ack = {}  # secondary_url -> time of its last ack or heartbeat answer
+        self.reported_ids = {}  # secondary_url -> highest contiguous id it reported
+        self.last_catchup_check = {}  # secondary_url -> monotonic time of its last catch-up check
+
+        metrics.callback('replication_queue_depth', 'Entries waiting in the outbound queue of a secondary, retries included',
+                         'gauge', ['secondary'], lambda: {(url,): len(sender) for url, sender in list(self.senders.items())})
+        metrics.callback('replication_retries_total', 'Entries the live stream put back for another attempt',
+                         'counter', ['secondary'], lambda: {(url,): sender.retried for url, sender in list(self.senders.items())})
+        metrics.callback('replication_give_ups_total', 'Entries the live stream left to catch-up',
+                         'counter', ['secondary'], lambda: {(url,): sender.given_up for url, sender in list(self.senders.items())})
+        metrics.callback('replication_lag_ids', 'Master ids beyond the contiguous id a secondary last reported',
+                         'gauge', ['secondary'], lambda: {(url,): max(self.last_id() - contiguous_id, 0)
+                                                          for url, contiguous_id in list(self.reported_ids.items())})
+        metrics.callback('secondary_phi', 'Failure detector suspicion level of a secondary',
+                         'gauge', ['secondary'], lambda: {(url,): phi for url, phi in self.suspicion().items()})
+
+    def suspicion(self):
+        return self.heartbeats.suspicion() if self.heartbeats is not None else {}
+
+    def split_by_health(self):
+        """Healthy secondaries, fastest first, and the Suspected or Unhealthy ones, from one snapshot of the statuses."""
+        statuses = list(self.secondaries.items())
+        return (self.latencies.ranked([url for url, status in statuses if status == "Healthy"]),
+                [url for url, status in statuses if status != "Healthy"])
+
+    def check_quorum(self):
+        """Check if the number of healthy secondaries meets the quorum size."""
+        healthy_count = sum(1 for status in list(self.secondaries.values()) if status == "Healthy")
+
+        if healthy_count < self.quorum_size:
+            self.read_only = True
+            self.log("Quorum not met. Master switching to read-only mode.", log_type='warning', quorum_size=self.quorum_size, healthy_count=healthy_count)
+        else:
+            # Logged at info only when leaving read-only mode, not on every heartbeat round
+            self.log("Quorum met. Master in write mode.", log_type='info' if self.read_only else 'debug', quorum_size=self.quorum_size, healthy_count=healthy_count)
+            self.read_only = False
+
+    def update_statuses(self, statuses, suspicion):
+        """Apply the failure detector's statuses and re-check the quorum whenever one of them changed."""
+        with self.lock:
+            for secondary_url, status in statuses.items():
+                if secondary_url in self.secondaries and self.secondaries[secondary_url] != status:
+                    self.log(f"Secondary {secondary_url} is now {status}", log_type='info' if status == "Healthy" else 'warning',
+                             previous=self.secondaries[secondary_url], phi=round(suspicion.get(secondary_url, 0), 2))
+                    self.secondaries[secondary_url] = status
+            self.check_quorum()
+
+    def update_quorum(self):
+        """Derive the quorum from the current membership and re-check it."""
+        with self.lock:
+            self.quorum_size = derived_quorum(len(self.secondaries), quorum_override)
+            self.check_quorum()
+
+    def get_sender(self, secondary_url, sender_class, send_batch):
+        """Return the replication sender for a secondary, starting it on first use. None once it left the cluster."""
+        with self.lock:
+            sender = self.senders.get(secondary_url)
+            if sender is None:
+                if secondary_url not in self.secondaries:
+                    return None
+                sender = sender_class(
+                    secondary_url, send_batch, self.log,
+                    max_batch_size=replication_batch_size,
+                    max_linger=replication_linger,
+                    in_flight=replication_in_flight,
+                    retries=replication_retries,
+                    on_give_up=self.park_ack,
+                    max_pending=replication_queue_size,
+                    enqueue_timeout=replication_enqueue_timeout
+                )
+                sender.start()
+                self.senders[secondary_url] = sender
+            return sender
+
+    def wire_format(self, secondary_url):
+        return self.wire_formats.get(secondary_url, replication_wire_format)
+
+    def reject_binary(self, secondary_url):
+        """An older secondary that only understands JSON: remember it."""
+        self.wire_formats[secondary_url] = 'json'
+        self.log(f"Binary wire format rejected by {secondary_url}, falling back to JSON", log_type='warning')
+
+    def record_round_trip(self, secondary_url, seconds):
+        self.latencies.record(secondary_url, seconds)
+        replication_rtt.labels(secondary_url).observe(seconds)
+
+    def note_progress(self, secondary_url, contiguous_id, from_probe=False):
+        """Record a secondary's reported contiguous id. Returns the (from_id, upto_id) range to catch it up on, or None.
+
+        Heartbeat answers are always checked. Acks arrive far more often, so they trigger the check
+        at most once per heartbeat interval, which keeps the catch-up horizon meaningful. The caller
+        runs the catch-up and reports catchup_finished() when it ends.
+        """
+        with self.lock:
+            status = self.secondaries.get(secondary_url)
+            if status is None:
+                return None  # Left the cluster while the request was on the wire
+            self.last_ack[secondary_url] = datetime.now().isoformat()
+            self.reported_ids[secondary_url] = contiguous_id
+            now = time.monotonic()
+            recovered = status != "Healthy"
+            if not (from_probe or recovered or now - self.last_catchup_check.get(secondary_url, 0) >= heartbeat_interval):
+                return None
+            self.last_catchup_check[secondary_url] = now
+
+            last_id = self.last_id()
+            # Entries older than the previous heartbeat should have arrived by now. A node that was
+            # unreachable was skipped by the live stream, so it is missing everything up to now.
+            upto_id = last_id if recovered else self.catchup_horizon.get(secondary_url, 0)
+            self.catchup_horizon[secondary_url] = last_id
+            # Parked entries may have been stored even though their ack was lost on the way back
+            callbacks = self._take_parked(secondary_url, lambda message_id: message_id <= contiguous_id)
+            start = contiguous_id < upto_id and secondary_url not in self.catchups_running
+            if start:
+                self.catchups_running.add(secondary_url)
+        self._fire(secondary_url, callbacks)
+        return (contiguous_id, upto_id) if start else None
+
+    def catchup_finished(self, secondary_url):
+        with self.lock:
+            self.catchups_running.discard(secondary_url)
+
+    def park_ack(self, secondary_url, message, on_ack):
+        """Keep the ack callback of an entry the live stream did not deliver, so catch-up can still count it toward w."""
+        with self.lock:
+            if secondary_url not in self.secondaries:
+                return
+            parked = self.parked_acks.setdefault(secondary_url, {})
+            parked.setdefault(message['id'], []).append(on_ack)
+            if len(parked) > write_history_size:
+                # Writes that old are gone from GET /writes/<id>, so nobody can see their ack any more
+                del parked[next(iter(parked))]
+
+    def release_parked_acks(self, secondary_url, is_stored):
+        """Fire the parked ack callbacks for entries the secondary now has."""
+        with self.lock:
+            callbacks = self._take_parked(secondary_url, is_stored)
+        self._fire(secondary_url, callbacks)
+
+    def _take_parked(self, secondary_url, is_stored):
+        parked = self.parked_acks.get(secondary_url, {})
+        stored = [message_id for message_id in parked if is_stored(message_id)]
+        return [on_ack for message_id in stored for on_ack in parked.pop(message_id)]
+
+    def _fire(self, secondary_url, callbacks):
+        for on_ack in callbacks:
+            run_callback(self.log, secondary_url, on_ack)
+
+    def hedge_schedule(self, concern, ranked):
+        """Hedging plan of a write: yields (candidate, delay) steps.
+
+        The w - 1 fastest secondaries are expected to ack. At each step the caller waits up to delay, the
+        usual round trip of the slowest one still expected plus the batching linger, and if the write
+        concern is still not met, sends the entry straight to the candidate unless it acked already:
+        first the spare replicas, then the expected ones again, which skips a backed-up or paused
+        queue. Secondaries store an id once, so a duplicate only costs one request.
+        """
+        expected = ranked[:concern.required - 1]
+        for candidate in ranked[len(expected):] + expected:
+            waiting_on = [url for url in expected if url not in concern.acked_by] or [candidate]
+            yield candidate, replication_linger + max(self.latencies.hedge_delay(url, hedge_percentile) for url in waiting_on)
+            if candidate not in expected:
+                expected.append(candidate)
+
+    def track_write(self, message_id, concern):
+        """Keep the write concern of a new write for GET /writes/<id>."""
+        with self.lock:
+            self.write_concerns[message_id] = concern
+            if len(self.write_concerns) > write_history_size:
+                self.write_concerns.popitem(last=False)
+
+    def write_result(self, entry, concern, met, received):
+        """Answer of a write once its wait is over: (response body, status code). Also records its metrics."""
+        w = concern.required
+        result = {'message': entry['message'], 'id': entry['id'], **concern.report()}
+        write_latency.labels(w).observe(time.monotonic() - received)
+        writes_answered.labels(w, result['commit']).inc()
+        if not met:
+            # Only the request gives up; the senders and catch-up keep delivering the entry
+            self.log("Write concern timed out", log_type='warning', message_id=entry['id'], acks=result['acks'], write_concern=w)
+            return {'status': 'Write concern timeout', **result}, 202
+
+        if w == 1:
+            self.log("Returning with w=1 after the durable local write. Replication continues in background.", log_type='debug', write_concern=w)
+        else:
+            self.log("Write concern result", log_type='debug', acks=result['acks'], write_concern=w)
+        return {'status': 'Message replicated', **result}, 200
+
+    def write_status(self, message_id):
+        """Ack state of a write. Returns (response body, status code).
+
+        Recent writes report their own write concern. For older ones only the acks can be told, from the
+        contiguous ids the secondaries report, so their commit status is 'unknown'.
+        """
+        with self.lock:
+            concern = self.write_concerns.get(message_id)
+        if concern is not None:
+            return {'id': message_id, **concern.report()}, 200
+        if not 1 <= message_id <= self.last_id():
+            return {'error': 'Unknown message id'}, 404
+        acked_by = ['master'] + sorted(url for url, contiguous_id in list(self.reported_ids.items()) if contiguous_id >= message_id)
+        return {'id': message_id, 'commit': 'unknown', 'acked_by': acked_by, 'acks': len(acked_by), 'write_concern': None}, 200
+
+    def secondary_details(self):
+        """Per-secondary status, suspicion level, last ack time, replication lag in entries and round-trip latency."""
+        suspicion = self.suspicion()
+        last_id = self.last_id()
+        details = {}
+        for url, status in list(self.secondaries.items()):
+            contiguous_id = self.reported_ids.get(url)
+            details[url] = {
+                'status': status,
+                'phi': round(suspicion.get(url, 0), 3),
+                'last_ack': self.last_ack.get(url),
+                'contiguous_id': contiguous_id,
+                'lag': None if contiguous_id is None else max(last_id - contiguous_id, 0),
+                'latency': self.latencies.snapshot(url)
+            }
+        return details
+
+    def health_status(self, verbose=False):
+        self.log("Health status requested", log_type='debug')
+        return self.secondary_details() if verbose else dict(self.secondaries)
+
+    def quorum_status(self):
+        status = 'Read-Only' if self.read_only else 'Write'
+        self.log("Quorum status requested", log_type='debug', quorum_met=not self.read_only, status=status)
+        return {'quorum_met': not self.read_only, 'status': status, 'quorum_size': self.quorum_size,
+                'members': len(self.secondaries)}
+
+    def membership_status(self):
+        return {'secondaries': dict(self.secondaries), 'quorum_size': self.quorum_size, 'quorum_met': not self.read_only}
+
+    def register(self, data):
+        """Add a secondary to the cluster; registering a member again is a no-op. Returns (response body, status code).
+
+        Its heartbeats start at once, and the first answer starts a catch-up of everything written before it
+        joined; new writes reach it through its own replication sender.
+        """
+        try:
+            secondary_url = parse_member_url(data)
+        except ValueError as e:
+            return {'error': str(e)}, 400
+
+        with self.lock:
+            if secondary_url in self.secondaries:
+                return {'status': 'Already registered', 'url': secondary_url}, 200
+            self.catchup_horizon[secondary_url] = self.last_id()
+            self.secondaries[secondary_url] = "Healthy"
+            self.heartbeats.add(secondary_url)
+            self.update_quorum()
+            body = {'status': 'Registered', 'url': secondary_url, **self.membership_status()}
+        self.log(f"Secondary {secondary_url} registered", members=len(self.secondaries), quorum_size=self.quorum_size)
+        return body, 201
+
+    def deregister(self, data, on_leave=None):
+        """Remove a secondary from the cluster and stop replicating to it. Returns (response body, status code).
+
+        Entries still queued for it are dropped, and writes stop counting on its acks. on_leave(url)
+        releases what the master keeps for it, such as its connection pool.
+        """
+        try:
+            secondary_url = parse_member_url(data)
+        except ValueError as e:
+            return {'error': str(e)}, 400
+
+        with self.lock:
+            if secondary_url not in self.secondaries:
+                return {'error': 'Unknown secondary', 'url': secondary_url}, 404
+            del self.secondaries[secondary_url]
+            self.heartbeats.remove(secondary_url)
+            self.update_quorum()
+            sender = self.senders.pop(secondary_url, None)
+            for state in (self.parked_acks, self.wire_formats, self.catchup_horizon, self.last_ack, self.reported_ids,
+                          self.last_catchup_check):
+                state.pop(secondary_url, None)
+            body = self.membership_status()
+        dropped = sender.stop() if sender is not None else 0
+        if on_leave is not None:
+            on_leave(secondary_url)
+        self.log(f"Secondary {secondary_url} deregistered", members=len(self.secondaries), quorum_size=self.quorum_size, dropped=dropped)
+        return {'status': 'Deregistered', 'url': secondary_url, 'dropped': dropped, **body}, 200
@@ -0,0 +1,72 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class SecondaryPool:
+    """Keep-alive HTTP session for one secondary with a bounded connection pool."""
+
+    def __init__(self, base_url, pool_size=4, connect_timeout=1.0, read_timeout=5.0):
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+
+        # One host per pool; pool_block keeps the number of open sockets bounded under load
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount(base_url, self.adapter)
+
+    def get(self, path, timeout=None, **kwargs):
+        return self.session.get(f'{self.base_url}{path}', timeout=timeout or self.timeout, **kwargs)
+
+    def post(self, path, timeout=None, **kwargs):
+        return self.session.post(f'{self.base_url}{path}', timeout=timeout or self.timeout, **kwargs)
+
+    def stats(self):
+        """Pool counters: a hit reuses a kept-alive connection, a miss opens a new one."""
+        pools = self.adapter.poolmanager.pools
+        requests_sent = misses = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                requests_sent += pool.num_requests
+                misses += pool.num_connections
+        return {
+            'requests': requests_sent,
+            'hits': requests_sent - misses,
+            'misses': misses,
+            'pool_size': self.adapter._pool_maxsize,
+            'connect_timeout': self.timeout[0],
+            'read_timeout': self.timeout[1]
+        }
+
+    def close(self):
+        self.session.close()
+
+
+class PoolRegistry:
+    """Lazily creates one SecondaryPool per secondary URL."""
+
+    def __init__(self, **pool_kwargs):
+        self.pool_kwargs = pool_kwargs
+        self.pools = {}
+        self.lock = threading.Lock()
+
+    def get(self, secondary_url):
+        with self.lock:
+            pool = self.pools.get(secondary_url)
+            if pool is None:
+                pool = SecondaryPool(secondary_url, **self.pool_kwargs)
+                self.pools[secondary_url] = pool
+            return pool
+
+    def remove(self, secondary_url):
+        """Close and forget the pool of a secondary that left the cluster."""
+        with self.lock:
+            pool = self.pools.pop(secondary_url, None)
+        if pool is not None:
+            pool.close()
+
+    def stats(self):
+        with self.lock:
+            pools = dict(self.pools)
+        return {url: pool.stats() for url, pool in pools.items()}
@@ -0,0 +1,44 @@
+import os
+import random
+import time
+
+# Named fault profiles: (candidate delays in seconds, drop chance)
+PROFILES = {
+    'none': ((), 0.0),  # A well-behaved replica
+    'flaky': ((10, 15, 20, 30), 0.2),  # The original secondary_1: long replication delays and 20% missed requests
+}
+
+
+class FaultInjector:
+    """Simulated replica faults for testing: missed requests and replication delay.
+
+    The delay is only a sleep in the calling request thread. Callers apply it before taking any
+    lock, so a slow replica stays slow per request without serializing other requests or reads.
+    """
+
+    def __init__(self, delays=(), drop_chance=0.0):
+        self.delays = list(delays)  # Candidate delays in seconds; one is picked at random per request
+        self.drop_chance = drop_chance  # Probability of answering 500 as if the request was lost
+
+    @classmethod
+    def from_env(cls, delays=(), drop_chance=0.0):
+        """Use the given defaults unless FAULT_DELAYS (comma-separated seconds) or FAULT_DROP_CHANCE are set."""
+        env_delays = os.environ.get('FAULT_DELAYS')
+        if env_delays is not None:
+            delays = [float(delay) for delay in env_delays.split(',') if delay.strip()]
+        drop_chance = float(os.environ.get('FAULT_DROP_CHANCE', drop_chance))
+        return cls(delays, drop_chance)
+
+    @classmethod
+    def from_profile(cls, name):
+        """Start from a named profile in PROFILES; FAULT_DELAYS / FAULT_DROP_CHANCE still override it."""
+        if name not in PROFILES:
+            raise ValueError(f"Unknown fault profile {name!r}; expected one of {', '.join(PROFILES)}")
+        return cls.from_env(*PROFILES[name])
+
+    def should_drop(self):
+        return random.random() < self.drop_chance
+
+    def delay(self):
+        if self.delays:
+            time.sleep(random.choice(self.delays))
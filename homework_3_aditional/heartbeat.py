@@ -0,0 +1,266 @@
+import asyncio
+import heapq
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PhiAccrualDetector:
+    """Phi accrual failure detector for one node.
+
+    Keeps a window of heartbeat inter-arrival times and turns the time since the last heartbeat into
+    a suspicion level phi: phi = 1 means a 10% chance the node is still alive and only late, phi = 3 means 0.1%.
+    """
+
+    def __init__(self, expected_interval, window=100, min_std_ratio=0.1):
+        self.expected_interval = expected_interval
+        self.min_std = expected_interval * min_std_ratio  # Keeps a perfectly regular node from looking dead after a tiny delay
+        self.max_sample = expected_interval * 3  # Longer gaps are outages, not samples of the normal rhythm
+        # Bootstrap with two samples around the expected interval (mean = interval, std = interval / 4)
+        self.intervals = deque([expected_interval * 0.75, expected_interval * 1.25], maxlen=window)
+        self.last_heartbeat = time.monotonic()  # Registration counts as the first heartbeat
+        self.last_sample = self.last_heartbeat
+
+    def heartbeat(self, now=None):
+        """Record a sign of life.
+
+        Signals closer together than the expected interval (a stream of replication acks) refresh the
+        last heartbeat but are not sampled, so the statistics keep describing the gaps a quiet node has.
+        """
+        now = time.monotonic() if now is None else now
+        gap = now - self.last_sample
+        if gap >= self.expected_interval:
+            if gap <= self.max_sample:
+                self.intervals.append(gap)
+            self.last_sample = now
+        self.last_heartbeat = now
+
+    def phi(self, now=None):
+        now = time.monotonic() if now is None else now
+        elapsed = now - self.last_heartbeat
+        mean = sum(self.intervals) / len(self.intervals)
+        variance = sum((sample - mean) ** 2 for sample in self.intervals) / len(self.intervals)
+        std = max(math.sqrt(variance), self.min_std)
+
+        # Logistic approximation of the normal CDF, clamped so exp() stays in range
+        y = min(max((elapsed - mean) / std, -20.0), 20.0)
+        e = math.exp(-y * (1.5976 + 0.070566 * y * y))
+        p_later = e / (1.0 + e) if elapsed > mean else 1.0 - 1.0 / (1.0 + e)
+        return max(0.0, -math.log10(max(p_later, 1e-300)))
+
+
+class FailureDetectors:
+    """Phi detectors for a set of nodes, mapped to the Healthy / Suspected / Unhealthy statuses."""
+
+    def __init__(self, interval, suspect_phi=1.0, failure_phi=3.0):
+        self.interval = interval  # Expected time between heartbeats of one node
+        self.suspect_phi = suspect_phi
+        self.failure_phi = failure_phi
+        self.detectors = {}  # node url -> PhiAccrualDetector
+
+    def add(self, url):
+        self.detectors.setdefault(url, PhiAccrualDetector(self.interval))
+
+    def remove(self, url):
+        self.detectors.pop(url, None)
+
+    def heartbeat(self, url, now=None):
+        self.detectors[url].heartbeat(now)
+
+    def suspicion(self, now=None):
+        """Current phi of every node."""
+        now = time.monotonic() if now is None else now
+        return {url: detector.phi(now) for url, detector in self.detectors.items()}
+
+    def statuses(self, now=None):
+        statuses = {}
+        for url, phi in self.suspicion(now).items():
+            if phi >= self.failure_phi:
+                statuses[url] = "Unhealthy"
+            elif phi >= self.suspect_phi:
+                statuses[url] = "Suspected"
+            else:
+                statuses[url] = "Healthy"
+        return statuses
+
+
+class HeartbeatScheduler(FailureDetectors):
+    """Probes every node on its own schedule from a small thread pool, so one slow or dead node never delays the others.
+
+    probe(url) returns True when the node answered. Nodes reported alive through observe() within the
+    last interval are not probed at all. A node that did not answer is probed again after
+    retry_interval. Statuses are re-evaluated on every probe result and at least every tick seconds,
+    and on_statuses(statuses, suspicion) is called whenever one of them changed. The probe pool
+    follows the membership: one thread per node, at most max_workers if it is set.
+    """
+
+    def __init__(self, probe, on_statuses, interval, retry_interval=None, tick=None, max_workers=None, **thresholds):
+        super().__init__(interval, **thresholds)
+        self.probe = probe
+        self.on_statuses = on_statuses
+        self.retry_interval = retry_interval or interval / 4
+        self.tick = tick or interval / 10
+        self.max_workers = max_workers
+        self.pool = None
+        self.pool_size = 0
+
+        self.cond = threading.Condition()
+        self.schedule = []  # Heap of (due time, url), one entry per node that is not being probed
+        self.next_due = {}  # url -> time of its next probe; moved forward by observe()
+        self.in_flight = set()  # Nodes with a probe running
+        self.last_statuses = {}
+
+    def add(self, url):
+        with self.cond:
+            super().add(url)
+            self.next_due[url] = time.monotonic()
+            heapq.heappush(self.schedule, (self.next_due[url], url))
+            self._resize_pool()
+            self.cond.notify()
+
+    def remove(self, url):
+        """Stop probing a node; a probe already running finishes and is ignored."""
+        with self.cond:
+            super().remove(url)
+            self.next_due.pop(url, None)
+            self._resize_pool()
+
+    def _resize_pool(self):
+        """Swap in a pool sized for the current membership. Probes already submitted still run on the old one."""
+        size = max(len(self.detectors), 1)
+        if self.max_workers is not None:
+            size = min(size, self.max_workers)
+        if size != self.pool_size:
+            old_pool = self.pool
+            self.pool = ThreadPoolExecutor(max_workers=size, thread_name_prefix='heartbeat')
+            self.pool_size = size
+            if old_pool is not None:
+                old_pool.shutdown(wait=False)
+
+    def observe(self, url):
+        """Count other traffic from a node (a replication ack) as a heartbeat and postpone its probe."""
+        with self.cond:
+            if url in self.detectors:
+                now = time.monotonic()
+                self.heartbeat(url, now)
+                self.next_due[url] = now + self.interval
+
+    def start(self):
+        threading.Thread(target=self._run, name='heartbeat-scheduler', daemon=True).start()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                now = time.monotonic()
+                while self.schedule and self.schedule[0][0] <= now:
+                    _, url = heapq.heappop(self.schedule)
+                    if url not in self.detectors or url in self.in_flight:
+                        continue
+                    if self.next_due[url] > now:
+                        # Heard from it since this entry was pushed: only idle nodes are probed
+                        heapq.heappush(self.schedule, (self.next_due[url], url))
+                        continue
+                    self.in_flight.add(url)
+                    self.pool.submit(self._probe, url)
+                statuses = self.statuses(now)
+                changed = statuses != self.last_statuses
+                self.last_statuses = statuses
+                next_due = self.schedule[0][0] if self.schedule else now + self.tick
+                wait = min(self.tick, max(next_due - now, 0))
+
+            if changed:
+                self.on_statuses(statuses, self.suspicion(now))
+            with self.cond:
+                self.cond.wait(wait)
+
+    def _probe(self, url):
+        try:
+            alive = self.probe(url)
+        except Exception:
+            alive = False
+        with self.cond:
+            self.in_flight.discard(url)
+            if url in self.detectors:
+                now = time.monotonic()
+                if alive:
+                    self.heartbeat(url, now)
+                    self.next_due[url] = max(self.next_due[url], now + self.interval)
+                else:
+                    self.next_due[url] = now + self.retry_interval
+                heapq.heappush(self.schedule, (self.next_due[url], url))
+            self.cond.notify()  # Evaluate right away instead of at the next tick
+
+
+class AsyncHeartbeatScheduler(FailureDetectors):
+    """Event-loop version of HeartbeatScheduler: one probing task per node plus an evaluation task."""
+
+    def __init__(self, probe, on_statuses, interval, retry_interval=None, tick=None, **thresholds):
+        super().__init__(interval, **thresholds)
+        self.probe = probe  # Coroutine function: await probe(url) -> True when the node answered
+        self.on_statuses = on_statuses
+        self.retry_interval = retry_interval or interval / 4
+        self.tick = tick or interval / 10
+        self.tasks = {}
+        self.changed = None
+        self.next_due = {}  # url -> loop time of its next probe; moved forward by observe()
+        self.last_statuses = {}
+
+    def add(self, url):
+        super().add(url)
+        self.next_due.setdefault(url, 0)
+        if self.changed is not None and url not in self.tasks:
+            self.tasks[url] = asyncio.get_running_loop().create_task(self._probe_loop(url))
+
+    def remove(self, url):
+        super().remove(url)
+        self.next_due.pop(url, None)
+        task = self.tasks.pop(url, None)
+        if task is not None:
+            task.cancel()
+
+    def start(self):
+        """Start the tasks; must be called from the running event loop."""
+        self.changed = asyncio.Event()
+        for url in self.detectors:
+            self.tasks[url] = asyncio.get_running_loop().create_task(self._probe_loop(url))
+        self.tasks[None] = asyncio.get_running_loop().create_task(self._evaluate_loop())
+
+    def stop(self):
+        for task in self.tasks.values():
+            task.cancel()
+
+    def observe(self, url):
+        """Count other traffic from a node (a replication ack) as a heartbeat and postpone its probe."""
+        if url in self.detectors:
+            self.heartbeat(url)
+            self.next_due[url] = time.monotonic() + self.interval
+
+    async def _probe_loop(self, url):
+        while url in self.detectors:
+            idle_for = self.next_due[url] - time.monotonic()
+            if idle_for > 0:
+                # Heard from it recently: only idle nodes are probed
+                await asyncio.sleep(idle_for)
+                continue
+            try:
+                alive = await self.probe(url)
+            except Exception:
+                alive = False
+            if alive:
+                self.heartbeat(url)
+            self.next_due[url] = time.monotonic() + (self.interval if alive else self.retry_interval)
+            self.changed.set()
+
+    async def _evaluate_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.changed.wait(), self.tick)
+            except asyncio.TimeoutError:
+                pass
+            self.changed.clear()
+            statuses = self.statuses()
+            if statuses != self.last_statuses:
+                self.last_statuses = statuses
+                self.on_statuses(statuses, self.suspicion())
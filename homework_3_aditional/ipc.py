@@ -0,0 +1,79 @@
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+from multiprocessing import AuthenticationError
+
+
+class IPCServer:
+    """Serves named function calls to local processes over authenticated multiprocessing connections.
+
+    Each client connection gets its own thread and stays open, so a call costs one pickled
+    request/response round trip instead of a connect and handshake.
+    """
+
+    def __init__(self, address, authkey, backlog=128):
+        # Listener's default backlog of 1 drops handshakes when many worker threads connect at once
+        self.listener = Listener(address, authkey=authkey, backlog=backlog)
+        self.address = self.listener.address  # The real address, also when bound to port 0
+        self.handlers = {}  # name -> function callable by clients
+
+    def serve_forever(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except (AuthenticationError, OSError):
+                continue
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        with conn:
+            while True:
+                try:
+                    name, args = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    result = (True, self.handlers[name](*args))
+                except Exception as e:
+                    result = (False, e)
+                conn.send(result)
+
+
+class IPCClient:
+    """Calls functions on an IPCServer through a pool of open connections, one borrowed per call."""
+
+    def __init__(self, address, authkey, connect_timeout=30):
+        self.address = address
+        self.authkey = authkey
+        self.connect_timeout = connect_timeout  # Seconds to keep retrying while the server starts up
+        self.idle = []  # Open connections not used by any call right now
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                return Client(self.address, authkey=self.authkey)
+            except ConnectionRefusedError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.1)
+
+    def call(self, name, *args):
+        with self.lock:
+            conn = self.idle.pop() if self.idle else None
+        if conn is None:
+            conn = self._connect()
+
+        try:
+            conn.send((name, args))
+            ok, result = conn.recv()
+        except BaseException:
+            conn.close()  # The connection may be mid-message; never hand it out again
+            raise
+
+        with self.lock:
+            self.idle.append(conn)
+        if not ok:
+            raise result
+        return result
@@ -0,0 +1,74 @@
+import threading
+from collections import deque
+
+
+class LatencyTracker:
+    """Round-trip times of one secondary: an EWMA that follows changes quickly, plus a sliding window for percentiles."""
+
+    def __init__(self, alpha=0.2, window=512, refresh=32):
+        self.alpha = alpha  # Weight of the newest sample in the EWMA
+        self.samples = deque(maxlen=window)  # Most recent round trips in seconds
+        self.refresh = refresh  # New samples before the sorted copy used for percentiles is rebuilt
+        self.ewma = None
+        self.count = 0
+        self._sorted = []
+        self._sorted_at = 0
+
+    def record(self, seconds):
+        self.ewma = seconds if self.ewma is None else self.ewma + self.alpha * (seconds - self.ewma)
+        self.samples.append(seconds)
+        self.count += 1
+
+    def percentile(self, q):
+        """Latency below which a fraction q of the recent samples fall, or None before the first sample."""
+        if not self._sorted or self.count - self._sorted_at >= self.refresh:
+            self._sorted = sorted(self.samples)
+            self._sorted_at = self.count
+        if not self._sorted:
+            return None
+        return self._sorted[min(int(q * len(self._sorted)), len(self._sorted) - 1)]
+
+    def snapshot(self):
+        """EWMA and percentiles in milliseconds, for /health?verbose=1."""
+        def ms(seconds):
+            return None if seconds is None else round(seconds * 1000, 2)
+        return {
+            'samples': self.count,
+            'ewma_ms': ms(self.ewma),
+            'p50_ms': ms(self.percentile(0.5)),
+            'p95_ms': ms(self.percentile(0.95)),
+            'p99_ms': ms(self.percentile(0.99))
+        }
+
+
+class ReplicaLatencies:
+    """Latency trackers for a set of secondaries, ranked fastest first for latency-aware write concerns."""
+
+    def __init__(self, **tracker_args):
+        self.tracker_args = tracker_args
+        self.trackers = {}  # secondary_url -> LatencyTracker
+        self.lock = threading.Lock()
+
+    def record(self, url, seconds):
+        with self.lock:
+            tracker = self.trackers.get(url)
+            if tracker is None:
+                tracker = self.trackers[url] = LatencyTracker(**self.tracker_args)
+            tracker.record(seconds)
+
+    def ranked(self, urls):
+        """urls ordered by EWMA latency, fastest first. Secondaries without samples yet go first, to get some."""
+        with self.lock:
+            return sorted(urls, key=lambda url: self.trackers[url].ewma if url in self.trackers else 0.0)
+
+    def hedge_delay(self, url, q=0.95, default=0.05):
+        """How long to wait on a secondary before hedging: its recent q-th percentile round trip."""
+        with self.lock:
+            tracker = self.trackers.get(url)
+            delay = tracker.percentile(q) if tracker is not None else None
+        return default if delay is None else delay
+
+    def snapshot(self, url):
+        with self.lock:
+            tracker = self.trackers.get(url)
+            return tracker.snapshot() if tracker is not None else None
@@ -1,185 +1,391 @@
 import threading
 import requests
 import time
-import logging
 from flask import Flask, request, jsonify
 from datetime import datetime
-import json
-from multiprocessing import Value
+import os
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from replication import ReplicationSender
+from connection_pool import PoolRegistry
+from wal import WriteAheadLog
+from sequencer import Sequencer
+from message_store import parse_page_args, parse_tail_args, format_page, TailNotifier
+import wire
+from heartbeat import HeartbeatScheduler
+from cluster_state import ClusterState, WriteConcern, parse_write_request, time_left
+from cluster_state import (secondary_urls, heartbeat_interval, heartbeat_timeout, phi_suspect_threshold, phi_failure_threshold,
+                           replication_in_flight, catchup_batch_size, metrics, heartbeat_results, hedges_sent, lock_wait)
+from structured_log import setup_logging, pretty_log
+from metrics import TimedLock, CONTENT_TYPE
 
 app = Flask(__name__)
 
-# Configure pretty logging
-logging.basicConfig(filename='master.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-secondaries = {
-    "http://secondary1:5001": "Healthy",
-    "http://secondary2:5002": "Healthy"
-}
-heartbeat_interval = 10  # Heartbeat interval in seconds
-heartbeat_timeout = 3  # Timeout for heartbeat requests
-quorum_size = 2  # Required number of healthy secondaries for quorum
-master_read_only = False  # Flag to track read-only mode
-
-# Master messages - list of dicts
-messages = []
-messages_lock = threading.Lock()  # Lock for thread safety
-
-
-def pretty_log(msg, log_type='info', **kwargs):
-    """Pretty log helper for structured logs."""
-    log_entry = {
-        'event': msg,
-        'timestamp': datetime.now().isoformat(),
-        'details': kwargs
-    }
-    if log_type == 'info':
-        logging.info(json.dumps(log_entry, indent=4))
-    elif log_type == 'warning':
-        logging.warning(json.dumps(log_entry, indent=4))
-    elif log_type == 'error':
-        logging.error(json.dumps(log_entry, indent=4))
-
-
-def check_quorum():
-    """Check if the number of healthy secondaries meets the quorum size."""
-    global master_read_only
-    healthy_count = sum(1 for status in secondaries.values() if status == "Healthy")
-    
-    if healthy_count < quorum_size:
-        master_read_only = True
-        pretty_log("Quorum not met. Master switching to read-only mode.", log_type='warning', quorum_size=quorum_size, healthy_count=healthy_count)
-    else:
-        master_read_only = False
-        pretty_log("Quorum met. Master in write mode.", quorum_size=quorum_size, healthy_count=healthy_count)
-
-
-def heartbeat_check():
-    """Periodically checks the health of secondaries and updates the quorum status."""
-    while True:
-        for secondary_url in secondaries.keys():
-            try:
-                response = requests.get(f"{secondary_url}/heartbeat", timeout=heartbeat_timeout)
-                if response.status_code == 200:
-                    secondaries[secondary_url] = "Healthy"
-                    pretty_log(f"Heartbeat check successful for {secondary_url}", status="Healthy")
-                else:
-                    secondaries[secondary_url] = "Suspected"
-                    pretty_log(f"Heartbeat check for {secondary_url}", status="Suspected", response_code=response.status_code)
-            except requests.exceptions.RequestException:
-                secondaries[secondary_url] = "Unhealthy"
-                pretty_log(f"Heartbeat check failed for {secondary_url}", status="Unhealthy", error="RequestException")
-        
-        # After heartbeat checks, update quorum status
-        check_quorum()
-        time.sleep(heartbeat_interval)
-
-
-def replicate_to_secondary(secondary_url, message, ack_event, ack_count, retries=7):
-    """Replicate the message to a secondary. If successful, increment the ack_count and set the ack_event if required."""
-    for attempt in range(retries):
-        try:
-            response = requests.post(f'{secondary_url}/replicate', json=message, timeout=5)
-            if response.status_code == 200:
-                with ack_count.get_lock():
-                    ack_count.value += 1
-                    if ack_count.value >= ack_count.required:
-                        ack_event.set()  # Signal the event if we have enough acks
-                pretty_log(f"Replication successful for {secondary_url}", status="Success", message_id=message['id'])
-                return True
-        except requests.exceptions.RequestException as e:
-            pretty_log(f"Replication failed for {secondary_url}", log_type='error', error=str(e), attempt=attempt + 1)
-            time.sleep(3 ** attempt)  # Exponential backoff
+# Structured logging: compact JSON lines written by a background thread, rotated by size
+setup_logging('master.log')
+
+# Settings, metrics and the membership, quorum and catch-up policy live in cluster_state.py, shared with master_async.py
+hedge_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('HEDGE_WORKERS', 4)), thread_name_prefix='hedge')
+
+# Keep-alive connection pools, one per secondary, shared by replication and heartbeats
+secondary_pools = PoolRegistry(
+    pool_size=int(os.environ.get('POOL_SIZE', replication_in_flight + 2)),  # Senders plus the heartbeat probe
+    connect_timeout=float(os.environ.get('POOL_CONNECT_TIMEOUT', 1)),
+    read_timeout=float(os.environ.get('POOL_READ_TIMEOUT', 5))
+)
+
+# Write-ahead log for master entries; fsyncs of concurrent writes are coalesced into one per commit window
+wal = WriteAheadLog(
+    os.environ.get('WAL_PATH', 'master.wal'),
+    pretty_log,
+    commit_window=float(os.environ.get('WAL_COMMIT_WINDOW', 0.002))
+)
+metrics.callback('wal_fsyncs_total', 'Group commits of the write-ahead log, one fsync each',
+                 'counter', (), lambda: {(): wal.fsyncs})
+
+# Master messages - list of dicts, recovered from the write-ahead log on startup
+messages = wal.open()
+messages_lock = TimedLock(lock_wait.labels('messages_lock'))  # Lock for thread safety; records its wait times
+sequencer = Sequencer(messages[-1]['id'] if messages else 0)  # Continues after the last logged id
+new_messages = TailNotifier(len(messages))  # Wakes /messages/tail long-polls once appends are durable
+
+# Membership, quorum and the progress of every secondary, measured against the durable prefix of the log
+cluster = ClusterState(secondary_urls, lambda: wal.durable, pretty_log)
+
+
+def probe_secondary(secondary_url):
+    """Send one heartbeat to a secondary. Returns True if it answered."""
+    try:
+        pool = secondary_pools.get(secondary_url)
+        # The master's last id lets the secondary tell how stale it is
+        response = pool.get('/heartbeat', timeout=(pool.timeout[0], heartbeat_timeout), headers={wire.MASTER_LAST_ID: str(wal.durable)})
+        if response.status_code == 200:
+            heartbeat_results.labels(secondary_url, 'ok').inc()
+            pretty_log(f"Heartbeat check successful for {secondary_url}", log_type='debug', status="Healthy")
+            start_catch_up(secondary_url, cluster.note_progress(secondary_url, response.json().get('contiguous_id', 0), from_probe=True))
+            return True
+        heartbeat_results.labels(secondary_url, 'error_status').inc()
+        pretty_log(f"Heartbeat check for {secondary_url}", log_type='warning', response_code=response.status_code)
+    except requests.exceptions.RequestException:
+        heartbeat_results.labels(secondary_url, 'unreachable').inc()
+        pretty_log(f"Heartbeat check failed for {secondary_url}", log_type='warning', error="RequestException")
     return False
 
 
-@app.route('/replicate', methods=['POST'])
-def replicate_message():
-    global master_read_only
-    
-    if master_read_only:
+# Concurrent heartbeats, each secondary on its own schedule, judged by a phi accrual failure detector
+heartbeats = HeartbeatScheduler(
+    probe_secondary, cluster.update_statuses, heartbeat_interval,
+    max_workers=int(os.environ['HEARTBEAT_WORKERS']) if os.environ.get('HEARTBEAT_WORKERS') else None,  # Default: one per secondary
+    suspect_phi=phi_suspect_threshold, failure_phi=phi_failure_threshold
+)
+cluster.heartbeats = heartbeats
+for secondary_url in cluster.secondaries:
+    heartbeats.add(secondary_url)
+
+
+def replicate_to_secondary(secondary_url, batch):
+    """Send a batch of messages to a secondary and return the set of message ids it acknowledged (None if unreachable)."""
+    message_ids = [message['id'] for message in batch]
+    binary = cluster.wire_format(secondary_url) == 'binary'
+    body, headers = wire.encode_request(batch, binary)
+    headers[wire.MASTER_LAST_ID] = str(wal.durable)
+    started = time.monotonic()
+    try:
+        response = secondary_pools.get(secondary_url).post('/replicate_batch', data=body, headers=headers)
+        cluster.record_round_trip(secondary_url, time.monotonic() - started)
+        if response.status_code == 200:
+            acked, contiguous_id = wire.decode_ack_response(response.headers.get('Content-Type', ''), response.content)
+            pretty_log(f"Replication successful for {secondary_url}", log_type='debug', status="Success", acked=len(acked))
+            heartbeats.observe(secondary_url)  # An ack is as good as a heartbeat; busy nodes are never probed
+            if contiguous_id is not None:
+                start_catch_up(secondary_url, cluster.note_progress(secondary_url, contiguous_id))
+            return acked
+        if response.status_code == 415 and binary:
+            cluster.reject_binary(secondary_url)  # Resend right away as JSON
+            return replicate_to_secondary(secondary_url, batch)
+        pretty_log(f"Replication failed for {secondary_url}", log_type='error', response_code=response.status_code, message_ids=message_ids)
+    except requests.exceptions.RequestException as e:
+        cluster.record_round_trip(secondary_url, time.monotonic() - started)  # A timeout is the slowest answer of all
+        pretty_log(f"Replication failed for {secondary_url}", log_type='error', error=str(e), message_ids=message_ids)
+        return None
+    return set()
+
+
+def get_sender(secondary_url):
+    """Return the replication sender for a secondary, starting it on first use. None once it left the cluster."""
+    return cluster.get_sender(secondary_url, ReplicationSender, replicate_to_secondary)
+
+
+def catch_up(secondary_url, from_id, upto_id):
+    """Stream entries (from_id, upto_id] from the master log to a lagging secondary in bulk batches."""
+    pretty_log(f"Catch-up started for {secondary_url}", from_id=from_id, upto_id=upto_id)
+    try:
+        next_id = from_id
+        while next_id < upto_id:
+            with messages_lock:
+                chunk = messages[next_id:min(next_id + catchup_batch_size, upto_id)]  # Entry with id n sits at n - 1
+            acked = replicate_to_secondary(secondary_url, chunk) or set()
+            cluster.release_parked_acks(secondary_url, acked.__contains__)
+            if len(acked) < len(chunk):
+                # The next heartbeat reports the new contiguous id and resumes from there
+                pretty_log(f"Catch-up interrupted for {secondary_url}", log_type='warning', next_id=next_id)
+                return
+            next_id += len(chunk)
+        pretty_log(f"Catch-up finished for {secondary_url}", upto_id=upto_id)
+    finally:
+        cluster.catchup_finished(secondary_url)
+
+
+def start_catch_up(secondary_url, span):
+    """Run the catch-up note_progress() asked for, if any, on its own thread."""
+    if span is not None:
+        threading.Thread(target=catch_up, args=(secondary_url, *span), daemon=True).start()
+
+
+def send_hedge(secondary_url, entry, concern):
+    """Send one entry straight to a secondary, outside its batching queue, and count its ack."""
+    if entry['id'] in (replicate_to_secondary(secondary_url, [entry]) or set()):
+        concern.ack(secondary_url)
+
+
+def hedge_write(entry, concern, ranked, expires):
+    """Wait for the write concern, hedging replicas that answer slower than usual. Returns True once it is met."""
+    for candidate, delay in cluster.hedge_schedule(concern, ranked):
+        if concern.done.wait(time_left(expires, delay)):
+            return True
+        if time.monotonic() >= expires:
+            return False
+        if candidate not in concern.acked_by:
+            pretty_log(f"Hedging write to {candidate}", log_type='debug', message_id=entry['id'], after=round(delay, 4))
+            hedges_sent.labels(candidate).inc()
+            hedge_pool.submit(send_hedge, candidate, entry, concern)
+    return concern.done.wait(time_left(expires))
+
+
+def append_entries(texts, on_durable=None):
+    """Assign ids to new messages and append them to memory and the write-ahead log in one critical section.
+
+    Ids are reserved under messages_lock, so the list and the log are both in id order (id n sits at
+    index n - 1). Once the last entry, and therefore the whole range, is on disk, tail readers are
+    woken and on_durable fires. Returns (entries, WAL ticket of the last entry).
+    """
+    timestamp = datetime.now().isoformat()
+
+    def durable():
+        new_messages.publish(entries[-1]['id'])
+        if on_durable is not None:
+            on_durable()
+
+    with messages_lock:
+        ids = sequencer.reserve(len(texts))
+        entries = [{'message': text, 'timestamp': timestamp, 'id': message_id} for text, message_id in zip(texts, ids)]
+        for entry in entries:
+            messages.append(entry)
+            ticket = wal.append(entry, on_durable=durable if entry is entries[-1] else None)
+    return entries, ticket
+
+
+def write_message(data):
+    """Append the message of a POST /replicate body and wait for w acknowledgments. Returns (response body, status code).
+
+    The wait is capped by wtimeout in milliseconds, or deadline in seconds (WRITE_DEADLINE by default).
+    A write that runs out of time answers 202 with the nodes that acked so far; it stays in every
+    replication queue and its ack state stays available from GET /writes/<id>. ack_mode 'fastest'
+    counts on the fastest healthy replicas and hedges when one of them is slow (WRITE_ACK_MODE by default).
+    """
+    received = time.monotonic()
+    if cluster.read_only:
         pretty_log("Master in read-only mode. Rejecting append request.", log_type='warning')
-        return jsonify({'error': 'Quorum not met. Master is in read-only mode and cannot accept new messages.'}), 503
+        return {'error': 'Quorum not met. Master is in read-only mode and cannot accept new messages.'}, 503
+
+    try:
+        message, w, ack_mode, timeout = parse_write_request(data, len(cluster.secondaries))
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    expires = time.monotonic() + timeout
+
+    # The master's own ack arrives once its write is durable
+    concern = WriteConcern(w)
+    (message_entry,), ticket = append_entries([message], on_durable=partial(concern.ack, 'master'))
+    cluster.track_write(message_entry['id'], concern)
+    pretty_log("Master received message", log_type='debug', message_id=message_entry['id'])
+
+    # Secondaries only get entries already on the master's disk, so a restarted master never hands their ids out again
+    if wal.wait_durable(ticket, time_left(expires)):
+        healthy, lagging = cluster.split_by_health()
+    else:
+        healthy, lagging = [], list(cluster.secondaries)  # Catch-up delivers it once the disk has it
+
+    # Hand the entry to the per-secondary batching senders, fastest secondary first
+    for secondary in healthy:
+        sender = get_sender(secondary)
+        if sender is None:
+            continue
+        on_ack = partial(concern.ack, secondary)
+        if not sender.enqueue(message_entry, on_ack, time_left(expires)):
+            # Backpressure: the queue stayed full until the deadline, so leave this entry to catch-up from the log
+            pretty_log(f"Replication queue full for {secondary}", log_type='warning', message_id=message_entry['id'])
+            cluster.park_ack(secondary, message_entry, on_ack)
+    # The live stream skips the others; catch-up delivers the entry once they recover, and their ack still counts
+    for secondary in lagging:
+        cluster.park_ack(secondary, message_entry, partial(concern.ack, secondary))
+
+    if ack_mode == 'fastest' and w > 1:
+        met = hedge_write(message_entry, concern, healthy, expires)
+    else:
+        met = concern.done.wait(time_left(expires))  # Returns as soon as w acknowledgments are received
+    # The request thread is released either way; the senders and catch-up keep delivering the entry
+    return cluster.write_result(message_entry, concern, met, received)
 
-    data = request.json
-    message = data.get('message')
-    w = data.get('w', 1)  # Get write concern parameter from the request
 
-    if message:
-        timestamp = datetime.now().isoformat()
-        message_entry = {
-            'message': message,
-            'timestamp': timestamp,
-            'id': len(messages) + 1  # Assuming ID is based on the length of messages
-        }
+# Entry points of the HTTP routes below, and of master_cluster.py's workers through the core process
 
-        # Ensure thread-safe access to the messages list
-        with messages_lock:
-            messages.append(message_entry)
+def write_status(message_id):
+    return cluster.write_status(message_id)
 
-        pretty_log(f"Master received message", message=message, message_id=message_entry['id'])
 
-    successful_acks = 1  # Acknowledge master
+def render_metrics():
+    return metrics.render()
 
-    # Event to signal when we've received enough acknowledgments
-    ack_event = threading.Event()
 
-    # A shared counter for acknowledgments
-    ack_count = Value('i', successful_acks)  # Start with the master's acknowledgment
-    ack_count.required = w  # Store the required number of acks
+def health_status(verbose=False):
+    return cluster.health_status(verbose), 200
 
-    threads = []
 
-    # Launch threads for replication
-    for secondary in secondaries.keys():
-        if secondaries[secondary] == "Healthy":  # Only replicate to healthy secondaries
-            t = threading.Thread(
-                target=replicate_to_secondary,
-                args=(secondary, message_entry, ack_event, ack_count)
-            )
-            t.start()
-            threads.append(t)
+def quorum_status():
+    return cluster.quorum_status(), 200
 
-    if w == 1:
-        pretty_log(f"Returning immediately with w=1. Replication continues in background.", write_concern=w)
-        return jsonify({'status': 'Message replicated', 'message': message}), 200
 
-    ack_event.wait()  # This will return as soon as w acknowledgments are received
+def membership_status():
+    return cluster.membership_status(), 200
+
+
+def register_secondary(data):
+    return cluster.register(data)
+
+
+def deregister_secondary(data):
+    return cluster.deregister(data, on_leave=secondary_pools.remove)
+
+
+def pool_stats():
+    return secondary_pools.stats(), 200
+
+
+def durable_end(since_id, limit):
+    """End of a page of messages: reads never go past the durable prefix of the log."""
+    return wal.durable if limit is None else min(since_id + limit, wal.durable)
+
+
+def read_messages(args):
+    """One page of messages for the GET /messages query arguments. Returns (response body, status code)."""
+    try:
+        since_id, limit, compact, paged = parse_page_args(args)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    pretty_log("Replicated messages requested", log_type='debug', since_id=since_id, limit=limit)
+    end = durable_end(since_id, limit)
+    with messages_lock:
+        page = messages[since_id:end]  # Entry with id n sits at n - 1, so the page is a slice
+    return format_page(page, since_id, compact, paged), 200
+
+
+def tail_messages_page(args):
+    """Long-poll for the GET /messages/tail query arguments. Returns (response body, status code)."""
+    try:
+        since_id, limit, compact, timeout = parse_tail_args(args)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    new_messages.wait_for(since_id, timeout)
+    end = durable_end(since_id, limit)
+    with messages_lock:
+        page = messages[since_id:end]
+    return format_page(page, since_id, compact, True), 200
+
+
+@app.route('/replicate', methods=['POST'])
+def replicate_message():
+    # w is the write concern; wtimeout (milliseconds) or deadline (seconds) and ack_mode are optional
+    body, status = write_message(request.get_json(silent=True))
+    return jsonify(body), status
 
-    pretty_log(f"ack_count.value: {ack_count.value}, required w: {w}")
-    if ack_count.value >= w:
-        return jsonify({'status': 'Message replicated', 'message': message}), 200
-    else:
-        return jsonify({'status': 'Replication failed'}), 500
+
+@app.route('/writes/<int:message_id>', methods=['GET'])
+def get_write_status(message_id):
+    """API to check which nodes acknowledged a write and whether its write concern is met."""
+    body, status = write_status(message_id)
+    return jsonify(body), status
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus scrape endpoint."""
+    return app.response_class(render_metrics(), content_type=CONTENT_TYPE)
 
 
 @app.route('/health', methods=['GET'])
 def get_health_status():
-    """API to check the health status of secondaries."""
-    pretty_log("Health status requested")
-    return jsonify(secondaries), 200
+    """API to check the health status of secondaries; verbose=1 adds each one's phi, last ack time, lag and latency."""
+    body, status = health_status(request.args.get('verbose', '').lower() in ('1', 'true', 'yes'))
+    return jsonify(body), status
 
 
 @app.route('/quorum', methods=['GET'])
 def get_quorum_status():
     """API to check if the master is in read-only mode."""
-    status = 'Read-Only' if master_read_only else 'Write'
-    pretty_log("Quorum status requested", quorum_met=not master_read_only, status=status)
-    return jsonify({'quorum_met': not master_read_only, 'status': status}), 200
+    body, status = quorum_status()
+    return jsonify(body), status
+
+
+@app.route('/secondaries', methods=['GET'])
+def get_membership():
+    """API to list the secondaries in the cluster and the quorum derived from them."""
+    body, status = membership_status()
+    return jsonify(body), status
+
+
+@app.route('/secondaries', methods=['POST'])
+def post_secondary():
+    """API for a secondary to join the cluster: {"url": "http://host:port"}."""
+    body, status = register_secondary(request.get_json(silent=True))
+    return jsonify(body), status
+
+
+@app.route('/secondaries', methods=['DELETE'])
+def delete_secondary():
+    """API for a secondary to leave the cluster: {"url": "http://host:port"}."""
+    body, status = deregister_secondary(request.get_json(silent=True))
+    return jsonify(body), status
+
+
+@app.route('/pools', methods=['GET'])
+def get_pool_stats():
+    """API to inspect connection pool reuse (hits) and new connections (misses) per secondary."""
+    body, status = pool_stats()
+    return jsonify(body), status
 
 
 @app.route('/messages', methods=['GET'])
 def get_messages():
-    """API to get all replicated messages."""
-    pretty_log("Replicated messages requested")
-    with messages_lock:
-        sorted_messages = sorted(messages, key=lambda msg: msg['id'])
-    pretty_json = json.dumps({"messages": sorted_messages}, indent=4)
-    pretty_log("Messages retrieved", messages=sorted_messages)
-    return jsonify({'messages': sorted_messages}), 200
+    """API to get replicated messages, optionally one page after a since_id cursor (limit, compact)."""
+    body, status = read_messages(request.args)
+    return jsonify(body), status
+
+
+@app.route('/messages/tail', methods=['GET'])
+def tail_messages():
+    """Long-poll: return messages after since_id as soon as there are any, or an empty page after timeout seconds."""
+    body, status = tail_messages_page(request.args)
+    return jsonify(body), status
+
+
+def start_background():
+    """Start the heartbeat scheduler thread. Called once in the serving process: __main__, the cluster core or serving.py."""
+    heartbeats.start()
 
 
 if __name__ == '__main__':
-    heartbeat_thread = threading.Thread(target=heartbeat_check, daemon=True)
-    heartbeat_thread.start()  # Start the heartbeat check thread
+    start_background()
     app.run(host='0.0.0.0', port=5000)
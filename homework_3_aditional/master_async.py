@@ -0,0 +1,337 @@
+import asyncio
+import os
+import time
+from functools import partial
+from datetime import datetime
+from aiohttp import web, ClientSession, ClientTimeout, TCPConnector, ClientError
+from replication import AsyncReplicationSender
+from wal import WriteAheadLog
+from sequencer import Sequencer
+from message_store import parse_page_args, parse_tail_args, format_page, AsyncTailNotifier
+import wire
+from heartbeat import AsyncHeartbeatScheduler
+from cluster_state import ClusterState, AsyncWriteConcern, parse_write_request, time_left
+from cluster_state import (secondary_urls, heartbeat_interval, heartbeat_timeout, phi_suspect_threshold, phi_failure_threshold,
+                           replication_in_flight, catchup_batch_size, metrics, heartbeat_results, hedges_sent)
+from structured_log import setup_logging, pretty_log
+from metrics import CONTENT_TYPE
+
+# Asyncio master mode: fan-out, retries with backoff and write-concern waiting are coroutines on one event loop,
+# so a pending w=3 write costs one future instead of one blocked worker plus one thread per secondary.
+# Settings, metrics and the membership, quorum and catch-up policy live in cluster_state.py, shared with master.py.
+
+# Structured logging: compact JSON lines written by a background thread, rotated by size
+setup_logging('master.log')
+
+# Write-ahead log for master entries; fsyncs of concurrent writes are coalesced into one per commit window
+wal = WriteAheadLog(
+    os.environ.get('WAL_PATH', 'master.wal'),
+    pretty_log,
+    commit_window=float(os.environ.get('WAL_COMMIT_WINDOW', 0.002))
+)
+metrics.callback('wal_fsyncs_total', 'Group commits of the write-ahead log, one fsync each',
+                 'counter', (), lambda: {(): wal.fsyncs})
+
+# Master messages - list of dicts, recovered from the log. Only touched from the event loop, so no lock is needed.
+messages = wal.open()
+sequencer = Sequencer(messages[-1]['id'] if messages else 0)  # Continues after the last logged id
+new_messages = AsyncTailNotifier(len(messages))  # Wakes /messages/tail long-polls once appends are durable
+
+# Membership, quorum and the progress of every secondary, measured against the durable prefix of the log
+cluster = ClusterState(secondary_urls, lambda: wal.durable, pretty_log)
+
+
+async def wait_concern(concern, timeout):
+    """Wait up to timeout seconds for the write concern. Returns True once it is met."""
+    try:
+        await asyncio.wait_for(asyncio.shield(concern.done), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+async def probe_secondary(app, secondary_url):
+    """Send one heartbeat to a secondary. Returns True if it answered."""
+    try:
+        # The master's last id lets the secondary tell how stale it is
+        async with app['session'].get(f"{secondary_url}/heartbeat", timeout=ClientTimeout(total=heartbeat_timeout),
+                                      headers={wire.MASTER_LAST_ID: str(wal.durable)}) as response:
+            if response.status == 200:
+                heartbeat_results.labels(secondary_url, 'ok').inc()
+                pretty_log(f"Heartbeat check successful for {secondary_url}", log_type='debug', status="Healthy")
+                contiguous_id = (await response.json()).get('contiguous_id', 0)
+                start_catch_up(app, secondary_url, cluster.note_progress(secondary_url, contiguous_id, from_probe=True))
+                return True
+            heartbeat_results.labels(secondary_url, 'error_status').inc()
+            pretty_log(f"Heartbeat check for {secondary_url}", log_type='warning', response_code=response.status)
+    except (ClientError, asyncio.TimeoutError):
+        heartbeat_results.labels(secondary_url, 'unreachable').inc()
+        pretty_log(f"Heartbeat check failed for {secondary_url}", log_type='warning', error="RequestException")
+    return False
+
+
+def make_send_batch(app):
+    session = app['session']
+
+    async def replicate_to_secondary(secondary_url, batch):
+        """Send a batch of messages to a secondary and return the set of message ids it acknowledged (None if unreachable)."""
+        message_ids = [message['id'] for message in batch]
+        binary = cluster.wire_format(secondary_url) == 'binary'
+        body, headers = wire.encode_request(batch, binary)
+        headers[wire.MASTER_LAST_ID] = str(wal.durable)
+        started = time.monotonic()
+        try:
+            async with session.post(f'{secondary_url}/replicate_batch', data=body, headers=headers) as response:
+                cluster.record_round_trip(secondary_url, time.monotonic() - started)
+                if response.status == 200:
+                    acked, contiguous_id = wire.decode_ack_response(response.headers.get('Content-Type', ''), await response.read())
+                    pretty_log(f"Replication successful for {secondary_url}", log_type='debug', status="Success", acked=len(acked))
+                    app['heartbeats'].observe(secondary_url)  # An ack is as good as a heartbeat; busy nodes are never probed
+                    if contiguous_id is not None:
+                        start_catch_up(app, secondary_url, cluster.note_progress(secondary_url, contiguous_id))
+                    return acked
+                if response.status == 415 and binary:
+                    cluster.reject_binary(secondary_url)  # Resend right away as JSON
+                    return await replicate_to_secondary(secondary_url, batch)
+                pretty_log(f"Replication failed for {secondary_url}", log_type='error', response_code=response.status, message_ids=message_ids)
+        except (ClientError, asyncio.TimeoutError) as e:
+            cluster.record_round_trip(secondary_url, time.monotonic() - started)  # A timeout is the slowest answer of all
+            pretty_log(f"Replication failed for {secondary_url}", log_type='error', error=repr(e), message_ids=message_ids)
+            return None
+        return set()
+    return replicate_to_secondary
+
+
+async def catch_up(app, secondary_url, from_id, upto_id):
+    """Stream entries (from_id, upto_id] from the master log to a lagging secondary in bulk batches."""
+    pretty_log(f"Catch-up started for {secondary_url}", from_id=from_id, upto_id=upto_id)
+    try:
+        next_id = from_id
+        while next_id < upto_id:
+            chunk = messages[next_id:min(next_id + catchup_batch_size, upto_id)]  # Entry with id n sits at n - 1
+            acked = await app['send_batch'](secondary_url, chunk) or set()
+            cluster.release_parked_acks(secondary_url, acked.__contains__)
+            if len(acked) < len(chunk):
+                # The next heartbeat reports the new contiguous id and resumes from there
+                pretty_log(f"Catch-up interrupted for {secondary_url}", log_type='warning', next_id=next_id)
+                return
+            next_id += len(chunk)
+        pretty_log(f"Catch-up finished for {secondary_url}", upto_id=upto_id)
+    finally:
+        cluster.catchup_finished(secondary_url)
+
+
+def start_catch_up(app, secondary_url, span):
+    """Run the catch-up note_progress() asked for, if any, as its own task."""
+    if span is not None:
+        asyncio.create_task(catch_up(app, secondary_url, *span))
+
+
+def get_sender(app, secondary_url):
+    """Return the replication sender for a secondary, starting it on first use. None once it left the cluster."""
+    return cluster.get_sender(secondary_url, AsyncReplicationSender, app['send_batch'])
+
+
+async def send_hedge(app, secondary_url, entry, concern):
+    """Send one entry straight to a secondary, outside its batching queue, and count its ack."""
+    if entry['id'] in (await app['send_batch'](secondary_url, [entry]) or set()):
+        concern.ack(secondary_url)
+
+
+async def hedge_write(app, entry, concern, ranked, expires):
+    """Wait for the write concern, hedging replicas that answer slower than usual. Returns True once it is met."""
+    for candidate, delay in cluster.hedge_schedule(concern, ranked):
+        if await wait_concern(concern, time_left(expires, delay)):
+            return True
+        if time.monotonic() >= expires:
+            return False
+        if candidate not in concern.acked_by:
+            pretty_log(f"Hedging write to {candidate}", log_type='debug', message_id=entry['id'], after=round(delay, 4))
+            hedges_sent.labels(candidate).inc()
+            asyncio.create_task(send_hedge(app, candidate, entry, concern))
+    return await wait_concern(concern, time_left(expires))
+
+
+async def replicate_message(request):
+    received = time.monotonic()
+    if cluster.read_only:
+        pretty_log("Master in read-only mode. Rejecting append request.", log_type='warning')
+        return web.json_response({'error': 'Quorum not met. Master is in read-only mode and cannot accept new messages.'}, status=503)
+
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    try:
+        message, w, ack_mode, timeout = parse_write_request(data, len(cluster.secondaries))
+    except ValueError as e:
+        return web.json_response({'error': str(e)}, status=400)
+    expires = time.monotonic() + timeout
+
+    # No await between allocating the id and appending, so messages stays in id order (id n at index n - 1)
+    message_entry = {
+        'message': message,
+        'timestamp': datetime.now().isoformat(),
+        'id': sequencer.next_id()
+    }
+    write_concern = AsyncWriteConcern(w)
+    messages.append(message_entry)
+    cluster.track_write(message_entry['id'], write_concern)
+    # The flusher thread fsyncs the group; hop back onto the loop to count the master's ack and wake tail readers
+    loop = asyncio.get_running_loop()
+    durable = loop.create_future()
+
+    def on_durable():
+        write_concern.ack('master')
+        new_messages.publish(message_entry['id'])
+        durable.set_result(True)
+
+    wal.append(message_entry, on_durable=lambda: loop.call_soon_threadsafe(on_durable))
+    pretty_log("Master received message", log_type='debug', message_id=message_entry['id'])
+
+    # Secondaries only get entries already on the master's disk, so a restarted master never hands their ids out again
+    try:
+        await asyncio.wait_for(asyncio.shield(durable), time_left(expires))
+        healthy, lagging = cluster.split_by_health()
+    except asyncio.TimeoutError:
+        healthy, lagging = [], list(cluster.secondaries)  # Catch-up delivers it once the disk has it
+
+    # Fastest secondary first
+    for secondary in healthy:
+        sender = get_sender(request.app, secondary)
+        if sender is None:
+            continue
+        on_ack = partial(write_concern.ack, secondary)
+        if not await sender.enqueue(message_entry, on_ack, time_left(expires)):
+            # Backpressure: the queue stayed full until the deadline, so leave this entry to catch-up from the log
+            pretty_log(f"Replication queue full for {secondary}", log_type='warning', message_id=message_entry['id'])
+            cluster.park_ack(secondary, message_entry, on_ack)
+    # The live stream skips the others; catch-up delivers the entry once they recover, and their ack still counts
+    for secondary in lagging:
+        cluster.park_ack(secondary, message_entry, partial(write_concern.ack, secondary))
+
+    if ack_mode == 'fastest' and w > 1:
+        met = await hedge_write(request.app, message_entry, write_concern, healthy, expires)
+    else:
+        met = await wait_concern(write_concern, time_left(expires))  # Resolves as soon as w acknowledgments are received
+    body, status = cluster.write_result(message_entry, write_concern, met, received)
+    return web.json_response(body, status=status)
+
+
+async def get_write_status(request):
+    """API to check which nodes acknowledged a write and whether its write concern is met."""
+    body, status = cluster.write_status(int(request.match_info['message_id']))
+    return web.json_response(body, status=status)
+
+
+async def get_metrics(request):
+    """Prometheus scrape endpoint."""
+    return web.Response(body=metrics.render().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+
+async def get_health_status(request):
+    """API to check the health status of secondaries; verbose=1 adds each one's phi, last ack time, lag and latency."""
+    return web.json_response(cluster.health_status(request.query.get('verbose', '').lower() in ('1', 'true', 'yes')))
+
+
+async def get_quorum_status(request):
+    """API to check if the master is in read-only mode."""
+    return web.json_response(cluster.quorum_status())
+
+
+async def get_membership(request):
+    """API to list the secondaries in the cluster and the quorum derived from them."""
+    return web.json_response(cluster.membership_status())
+
+
+async def read_body(request):
+    """JSON body of a request, None if it is not valid JSON."""
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+async def post_secondary(request):
+    """API for a secondary to join the cluster: {"url": "http://host:port"}. Registering a member again is a no-op."""
+    body, status = cluster.register(await read_body(request))
+    return web.json_response(body, status=status)
+
+
+async def delete_secondary(request):
+    """API for a secondary to leave the cluster: {"url": "http://host:port"}. Entries still queued for it are dropped."""
+    body, status = cluster.deregister(await read_body(request))
+    return web.json_response(body, status=status)
+
+
+def durable_end(since_id, limit):
+    """End of a page of messages: reads never go past the durable prefix of the log."""
+    return wal.durable if limit is None else min(since_id + limit, wal.durable)
+
+
+async def get_messages(request):
+    """API to get replicated messages, optionally one page after a since_id cursor (limit, compact)."""
+    try:
+        since_id, limit, compact, paged = parse_page_args(request.query)
+    except ValueError as e:
+        return web.json_response({'error': str(e)}, status=400)
+
+    pretty_log("Replicated messages requested", log_type='debug', since_id=since_id, limit=limit)
+    page = messages[since_id:durable_end(since_id, limit)]  # Entry with id n sits at n - 1, so the page is a slice
+    return web.json_response(format_page(page, since_id, compact, paged))
+
+
+async def tail_messages(request):
+    """Long-poll: return messages after since_id as soon as there are any, or an empty page after timeout seconds."""
+    try:
+        since_id, limit, compact, timeout = parse_tail_args(request.query)
+    except ValueError as e:
+        return web.json_response({'error': str(e)}, status=400)
+
+    await new_messages.wait_for(since_id, timeout)
+    page = messages[since_id:durable_end(since_id, limit)]
+    return web.json_response(format_page(page, since_id, compact, True))
+
+
+async def on_startup(app):
+    # One keep-alive connector shared by replication and heartbeats; bounded per secondary only, so it grows with the membership
+    connector = TCPConnector(limit=0, limit_per_host=replication_in_flight + 2)
+    app['session'] = ClientSession(connector=connector, timeout=ClientTimeout(connect=1, sock_read=5))
+    app['send_batch'] = make_send_batch(app)
+    # Concurrent heartbeats, each secondary on its own schedule, judged by a phi accrual failure detector
+    app['heartbeats'] = AsyncHeartbeatScheduler(
+        partial(probe_secondary, app), cluster.update_statuses, heartbeat_interval,
+        suspect_phi=phi_suspect_threshold, failure_phi=phi_failure_threshold
+    )
+    cluster.heartbeats = app['heartbeats']
+    for secondary_url in cluster.secondaries:
+        app['heartbeats'].add(secondary_url)
+    app['heartbeats'].start()
+
+
+async def on_cleanup(app):
+    app['heartbeats'].stop()
+    for sender in list(cluster.senders.values()):
+        sender.stop()
+    await app['session'].close()
+
+
+def create_app():
+    app = web.Application()
+    app.router.add_post('/replicate', replicate_message)
+    app.router.add_get(r'/writes/{message_id:\d+}', get_write_status)
+    app.router.add_get('/metrics', get_metrics)
+    app.router.add_get('/health', get_health_status)
+    app.router.add_get('/quorum', get_quorum_status)
+    app.router.add_get('/secondaries', get_membership)
+    app.router.add_post('/secondaries', post_secondary)
+    app.router.add_delete('/secondaries', delete_secondary)
+    app.router.add_get('/messages', get_messages)
+    app.router.add_get('/messages/tail', tail_messages)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == '__main__':
+    web.run_app(create_app(), host='0.0.0.0', port=5000)
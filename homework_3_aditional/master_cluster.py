@@ -0,0 +1,123 @@
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+from flask import Flask, request, jsonify
+from werkzeug.serving import make_server
+from ipc import IPCServer, IPCClient
+from metrics import CONTENT_TYPE
+from serving import make_handler, server_backlog
+
+# Multi-process master: HTTP worker processes share one port, and a single core process owns the
+# id sequencer, the message log (memory + write-ahead log), replication and heartbeats.
+# Workers reach the core over local IPC, so parsing and serializing HTTP no longer competes with it for the GIL.
+workers = int(os.environ.get('MASTER_WORKERS', os.cpu_count() or 1))  # Number of HTTP worker processes
+host = '0.0.0.0'
+port = int(os.environ.get('MASTER_PORT', 5000))
+
+# master.py functions the workers may call on the core
+CORE_CALLS = ('write_message', 'write_status', 'health_status', 'quorum_status', 'pool_stats', 'read_messages', 'tail_messages_page',
+              'render_metrics', 'membership_status', 'register_secondary', 'deregister_secondary')
+
+
+def create_worker_app(core):
+    """Flask app with the master's endpoints, each forwarded to the core process."""
+    app = Flask(__name__)
+
+    @app.route('/replicate', methods=['POST'])
+    def replicate_message():
+        body, status = core.call('write_message', request.get_json(silent=True))
+        return jsonify(body), status
+
+    @app.route('/writes/<int:message_id>', methods=['GET'])
+    def get_write_status(message_id):
+        body, status = core.call('write_status', message_id)
+        return jsonify(body), status
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        return app.response_class(core.call('render_metrics'), content_type=CONTENT_TYPE)
+
+    @app.route('/health', methods=['GET'])
+    def get_health_status():
+        body, status = core.call('health_status', request.args.get('verbose', '').lower() in ('1', 'true', 'yes'))
+        return jsonify(body), status
+
+    @app.route('/quorum', methods=['GET'])
+    def get_quorum_status():
+        body, status = core.call('quorum_status')
+        return jsonify(body), status
+
+    @app.route('/secondaries', methods=['GET'])
+    def get_membership():
+        body, status = core.call('membership_status')
+        return jsonify(body), status
+
+    @app.route('/secondaries', methods=['POST'])
+    def post_secondary():
+        body, status = core.call('register_secondary', request.get_json(silent=True))
+        return jsonify(body), status
+
+    @app.route('/secondaries', methods=['DELETE'])
+    def delete_secondary():
+        body, status = core.call('deregister_secondary', request.get_json(silent=True))
+        return jsonify(body), status
+
+    @app.route('/pools', methods=['GET'])
+    def get_pool_stats():
+        body, status = core.call('pool_stats')
+        return jsonify(body), status
+
+    @app.route('/messages', methods=['GET'])
+    def get_messages():
+        body, status = core.call('read_messages', request.args.to_dict())
+        return jsonify(body), status
+
+    @app.route('/messages/tail', methods=['GET'])
+    def tail_messages():
+        body, status = core.call('tail_messages_page', request.args.to_dict())
+        return jsonify(body), status
+
+    return app
+
+
+def listen_reuseport(host, port):
+    """Listening socket with SO_REUSEPORT, so every worker binds the same port and the kernel spreads connections."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(server_backlog)
+    return sock
+
+
+def run_worker(core_address, authkey):
+    core = IPCClient(core_address, authkey)
+    sock = listen_reuseport(host, port)
+    # HTTP/1.1 keep-alive, so clients reuse their connections across the shared port
+    server = make_server(host, port, create_worker_app(core), threaded=True, request_handler=make_handler(), fd=sock.fileno())
+    server.serve_forever()
+
+
+def run_core(core_server):
+    import master  # Imported after the workers are forked: opens the write-ahead log and starts its threads
+
+    for name in CORE_CALLS:
+        core_server.handlers[name] = getattr(master, name)
+    master.start_background()
+    core_server.serve_forever()
+
+
+if __name__ == '__main__':
+    # Exit cleanly on SIGTERM, so multiprocessing stops the daemonic workers instead of leaving them on the port
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    authkey = os.urandom(16)  # Only processes forked from here know it
+    core_server = IPCServer(('127.0.0.1', 0), authkey)
+
+    # Fork before master is imported, so no worker inherits its threads, locks or open log
+    context = multiprocessing.get_context('fork')
+    for _ in range(workers):
+        context.Process(target=run_worker, args=(core_server.address, authkey), daemon=True).start()
+
+    run_core(core_server)
@@ -0,0 +1,63 @@
+import atexit
+import threading
+import requests
+from urllib.parse import urlsplit
+
+
+def parse_member_url(data):
+    """Base URL of the secondary in a register / deregister request body, without a trailing slash. Raises ValueError."""
+    url = data.get('url') if isinstance(data, dict) else None
+    parts = urlsplit(url.strip()) if isinstance(url, str) else None
+    if parts is None or parts.scheme not in ('http', 'https') or not parts.netloc:
+        raise ValueError('url must be the base URL of a secondary, e.g. http://secondary3:5003')
+    return url.strip().rstrip('/')
+
+
+def derived_quorum(members, fixed=None):
+    """Healthy secondaries needed to accept writes: with the master, a majority of the cluster. fixed overrides it."""
+    if fixed is not None:
+        return fixed
+    return (members + 1) // 2
+
+
+def parse_write_concern(w, members):
+    """Write concern of a write request: an int from 1 (the master alone) to every node. Raises ValueError."""
+    if isinstance(w, bool) or not isinstance(w, int) or not 1 <= w <= members + 1:
+        raise ValueError(f'w must be an integer from 1 to {members + 1}, the number of nodes')
+    return w
+
+
+class Registration:
+    """Keeps a secondary in the master's membership: registers on start, renews every interval, deregisters on exit.
+
+    Registering is idempotent, so the renewal also brings a restarted master (that only knows its
+    SECONDARIES) back up to date within one interval.
+    """
+
+    def __init__(self, master_url, advertise_url, log, interval=30.0, timeout=3.0):
+        self.endpoint = f"{master_url.rstrip('/')}/secondaries"
+        self.advertise_url = advertise_url  # The URL the master should use to reach this secondary
+        self.log = log
+        self.interval = interval
+        self.timeout = timeout
+        self.stopped = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name='registration', daemon=True).start()
+        atexit.register(self.deregister)
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self._send('post')
+            self.stopped.wait(self.interval)
+
+    def deregister(self):
+        self.stopped.set()
+        self._send('delete')
+
+    def _send(self, method):
+        try:
+            response = requests.request(method, self.endpoint, json={'url': self.advertise_url}, timeout=self.timeout)
+            self.log(f"Membership {method} answered", log_type='debug', master=self.endpoint, response_code=response.status_code)
+        except requests.exceptions.RequestException:
+            self.log(f"Membership {method} failed", log_type='warning', master=self.endpoint, error="RequestException")
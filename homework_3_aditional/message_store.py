@@ -0,0 +1,222 @@
+import asyncio
+import threading
+import time
+from collections import deque
+
+MAX_PAGE_SIZE = 1000  # Upper bound for the limit query argument
+DEFAULT_TAIL_TIMEOUT = 25  # Seconds a long-poll waits for new messages by default
+MAX_TAIL_TIMEOUT = 60
+
+
+def parse_page_args(args):
+    """Read the since_id / limit / compact query arguments. Raises ValueError on bad input."""
+    since_id = int(args.get('since_id', 0))
+    limit = args.get('limit')
+    limit = None if limit is None else min(int(limit), MAX_PAGE_SIZE)
+    if since_id < 0 or (limit is not None and limit < 1):
+        raise ValueError('since_id must be >= 0 and limit >= 1')
+    compact = args.get('compact', '').lower() in ('1', 'true', 'yes')
+    paged = any(name in args for name in ('since_id', 'limit', 'compact'))
+    return since_id, limit, compact, paged
+
+
+def parse_tail_args(args):
+    """Page arguments plus the long-poll timeout in seconds. Raises ValueError on bad input."""
+    since_id, limit, compact, _ = parse_page_args(args)
+    timeout = min(float(args.get('timeout', DEFAULT_TAIL_TIMEOUT)), MAX_TAIL_TIMEOUT)
+    if timeout < 0:
+        raise ValueError('timeout must be >= 0')
+    return since_id, limit, compact, timeout
+
+
+def parse_freshness_args(args):
+    """Read the min_id / max_staleness (seconds) query arguments of a replica read. Raises ValueError on bad input."""
+    min_id = int(args.get('min_id', 0))
+    max_staleness = args.get('max_staleness')
+    max_staleness = None if max_staleness is None else float(max_staleness)
+    if min_id < 0 or (max_staleness is not None and max_staleness < 0):
+        raise ValueError('min_id and max_staleness must be >= 0')
+    return min_id, max_staleness
+
+
+def format_page(entries, since_id, compact, paged):
+    """Build the GET /messages body. Plain requests keep the original {'messages': [...]} shape;
+    paged ones also get next_since_id to pass back as the cursor, and compact ones [id, message, timestamp] rows."""
+    if compact:
+        body = {'messages': [[entry['id'], entry['message'], entry['timestamp']] for entry in entries]}
+    else:
+        body = {'messages': entries}
+    if paged:
+        body['next_since_id'] = entries[-1]['id'] if entries else since_id
+    return body
+
+
+class ContiguousLog:
+    """Id-ordered message store: a contiguous prefix of ids 1..n plus a small buffer of entries that arrived early.
+
+    Added entries count as unsynced until mark_durable(); the watermark (contiguous_id) stops below the
+    first of them, so readers and acks never see an entry a crash could still lose. It only moves
+    forward, and each entry is moved from the buffer into the prefix once, so adds are amortized O(1)
+    and reading the consistent view is a list slice.
+    """
+
+    def __init__(self, entries=()):
+        self.prefix = []  # prefix[i] holds the entry with id i + 1
+        self.out_of_order = {}  # id -> entry for ids beyond the prefix
+        self.unsynced = set()  # Ids added but not on disk yet
+        self.unstored = set()  # Ids whose write failed; the next copy to arrive is stored again
+        for entry in entries:
+            self.add(entry)
+        self.unsynced.clear()  # Recovered entries are on disk already
+        self.durable_id = len(self.prefix)
+
+    @property
+    def contiguous_id(self):
+        """Highest id such that every id up to it has been received and is on disk."""
+        return self.durable_id
+
+    def __contains__(self, message_id):
+        return 1 <= message_id <= len(self.prefix) or message_id in self.out_of_order
+
+    def __len__(self):
+        return len(self.prefix) + len(self.out_of_order)
+
+    def add(self, entry):
+        """Store an entry. Returns False if its id is already known."""
+        message_id = entry['id']
+        if message_id in self.unstored:
+            self.unstored.discard(message_id)
+            return True
+        if message_id in self:
+            return False
+
+        if message_id == len(self.prefix) + 1:
+            self.prefix.append(entry)
+            # Close the gap: pull any buffered successors into the prefix
+            while len(self.prefix) + 1 in self.out_of_order:
+                self.prefix.append(self.out_of_order.pop(len(self.prefix) + 1))
+        else:
+            self.out_of_order[message_id] = entry
+        self.unsynced.add(message_id)  # Cannot move the watermark: it already stops below this id
+        return True
+
+    def is_durable(self, message_id):
+        return message_id in self and message_id not in self.unsynced
+
+    def mark_durable(self, message_ids):
+        """Record that entries reached the disk, which may advance the watermark."""
+        self.unsynced.difference_update(message_ids)
+        self.durable_id = min(len(self.prefix), min(self.unsynced, default=len(self.prefix) + 1) - 1)
+
+    def mark_unstored(self, message_ids):
+        """Record that writing entries failed: they stay unsynced, and the next copy of each is stored again."""
+        self.unstored.update(message_ids)
+
+    def read(self, since_id=0, limit=None):
+        """Entries after since_id in id order, never past the watermark. Costs O(page size)."""
+        end = self.durable_id if limit is None else min(since_id + limit, self.durable_id)
+        return self.prefix[since_id:end]
+
+    def entries(self):
+        """Every stored entry, including the ones still waiting for a predecessor."""
+        return self.prefix + list(self.out_of_order.values())
+
+
+class TailNotifier:
+    """Wakes long-poll readers once messages beyond their cursor become visible."""
+
+    def __init__(self, last_id=0):
+        self.last_id = last_id  # Highest visible id
+        self.cond = threading.Condition()
+
+    def publish(self, last_id):
+        with self.cond:
+            if last_id > self.last_id:
+                self.last_id = last_id
+                self.cond.notify_all()
+
+    def wait_for(self, since_id, timeout):
+        """Block until a message after since_id is visible. Returns False on timeout."""
+        with self.cond:
+            return self.cond.wait_for(lambda: self.last_id > since_id, timeout)
+
+
+class FreshnessTracker:
+    """How current a replica is, measured on its own clock from the master's last id on every contact.
+
+    Each batch or heartbeat leaves a checkpoint (arrival time, master's last id). Once the contiguous
+    prefix reaches a checkpoint's id, the replica was as current as the master at that time, and its
+    staleness is the time since. Readers wait on the condition for a min_id or max_staleness to hold.
+    """
+
+    def __init__(self, contiguous_id=0, max_checkpoints=1024):
+        self.cond = threading.Condition()
+        self.checkpoints = deque(maxlen=max_checkpoints)  # (monotonic time, master's last id); dropping old ones only costs precision
+        self.contiguous_id = contiguous_id
+        self.current_as_of = None  # Monotonic time the replica was last known current; None before the first contact
+
+    def contact(self, master_last_id):
+        with self.cond:
+            self.checkpoints.append((time.monotonic(), master_last_id))
+            self._advance()
+
+    def advance(self, contiguous_id):
+        with self.cond:
+            self.contiguous_id = max(self.contiguous_id, contiguous_id)
+            self._advance()
+
+    def _advance(self):
+        advanced = False
+        while self.checkpoints and self.checkpoints[0][1] <= self.contiguous_id:
+            self.current_as_of = self.checkpoints.popleft()[0]
+            advanced = True
+        if advanced:
+            self.cond.notify_all()
+
+    def staleness(self):
+        """Seconds since the replica was last known to be as current as the master, None if never."""
+        return None if self.current_as_of is None else time.monotonic() - self.current_as_of
+
+    def _is_fresh(self, min_id, max_staleness):
+        if self.contiguous_id < min_id:
+            return False
+        if max_staleness is None:
+            return True
+        staleness = self.staleness()
+        return staleness is not None and staleness <= max_staleness
+
+    def wait_fresh(self, min_id, max_staleness, timeout):
+        """Block until the replica has min_id and is at most max_staleness seconds behind. Returns False on timeout."""
+        with self.cond:
+            return self.cond.wait_for(lambda: self._is_fresh(min_id, max_staleness), timeout)
+
+
+class AsyncTailNotifier:
+    """Event-loop version of TailNotifier: each waiting reader is a future, not a thread."""
+
+    def __init__(self, last_id=0):
+        self.last_id = last_id
+        self.waiters = set()
+
+    def publish(self, last_id):
+        if last_id > self.last_id:
+            self.last_id = last_id
+            for waiter in self.waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+            self.waiters.clear()
+
+    async def wait_for(self, since_id, timeout):
+        """Wait until a message after since_id is visible. Returns False on timeout."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self.last_id <= since_id:
+            waiter = loop.create_future()
+            self.waiters.add(waiter)
+            try:
+                await asyncio.wait_for(waiter, max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                return False
+            finally:
+                self.waiters.discard(waiter)
+        return True
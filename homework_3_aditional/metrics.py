@@ -0,0 +1,199 @@
+import bisect
+import threading
+import time
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'  # Prometheus text exposition format
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class CounterChild:
+    __slots__ = ('value', 'lock')
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class HistogramChild:
+    """Fixed buckets; an observation is one bisect and two additions under a lock."""
+    __slots__ = ('upper_bounds', 'counts', 'sum', 'lock')
+
+    def __init__(self, upper_bounds):
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * (len(upper_bounds) + 1)  # The last slot is the +Inf bucket
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.upper_bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        """Context manager that observes the duration of its block."""
+        return Timer(self)
+
+
+class Timer:
+    __slots__ = ('child', 'started')
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.started)
+
+
+class Metric:
+    """A named metric family; labels(*values) returns the child that records one label combination."""
+
+    def __init__(self, name, help, labelnames, kind, make_child):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+        self.make_child = make_child
+        self.children = {}  # label values -> child
+        self.lock = threading.Lock()
+        if not self.labelnames:
+            self.children[()] = make_child()
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.make_child())
+        return child
+
+    # Unlabelled metrics record directly on their single child
+    def inc(self, amount=1):
+        self.children[()].inc(amount)
+
+    def observe(self, value):
+        self.children[()].observe(value)
+
+    def time(self):
+        return self.children[()].time()
+
+    def samples(self):
+        lines = []
+        for values, child in list(self.children.items()):
+            labels = format_labels(self.labelnames, values)
+            if self.kind == 'counter':
+                lines.append(f'{self.name}{labels} {format_value(child.value)}')
+                continue
+            with child.lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(child.upper_bounds + (float('inf'),), counts):
+                cumulative += count
+                le = format_labels(self.labelnames, values, [('le', format_value(bound))])
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+            lines.append(f'{self.name}_sum{labels} {format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Callback:
+    """A gauge or counter read at scrape time from state the node keeps anyway, so it costs nothing on the hot path."""
+
+    def __init__(self, name, help, kind, labelnames, collect):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.collect = collect  # callable() -> {label values tuple: value}
+
+    def samples(self):
+        return [f'{self.name}{format_labels(self.labelnames, values)} {format_value(value)}'
+                for values, value in self.collect().items() if value is not None]
+
+
+class Registry:
+    """The metrics of one node, rendered in the Prometheus text format for GET /metrics."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Metric(name, help, labelnames, 'counter', CounterChild))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        buckets = tuple(sorted(buckets))
+        return self._add(Metric(name, help, labelnames, 'histogram', lambda: HistogramChild(buckets)))
+
+    def callback(self, name, help, kind, labelnames, collect):
+        return self._add(Callback(name, help, kind, labelnames, collect))
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            try:
+                samples = metric.samples()
+            except Exception:
+                continue  # A failing callback must not break the whole scrape
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+class TimedLock:
+    """threading.Lock that records in a histogram how long each acquisition waited.
+
+    An uncontended acquisition costs one extra non-blocking try; only a contended one reads the clock.
+    """
+
+    def __init__(self, wait_histogram):
+        self.lock = threading.Lock()
+        self.wait_histogram = wait_histogram  # A HistogramChild, e.g. metric.labels('messages_lock')
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self.lock.acquire(False):
+            self.wait_histogram.observe(0.0)
+            return True
+        if not blocking:
+            return False
+        started = time.perf_counter()
+        acquired = self.lock.acquire(True, timeout)
+        if acquired:
+            self.wait_histogram.observe(time.perf_counter() - started)
+        return acquired
+
+    def release(self):
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
@@ -0,0 +1,314 @@
+from flask import Flask, request, jsonify, redirect
+from werkzeug.serving import WSGIRequestHandler
+import argparse
+import os
+import signal
+import sys
+import time
+from segment_store import SegmentStore
+from faults import FaultInjector, PROFILES
+import wire
+from structured_log import setup_logging, pretty_log
+from membership import Registration
+from serving import PooledWSGIServer
+from metrics import Registry, TimedLock, CONTENT_TYPE
+from message_store import ContiguousLog, TailNotifier, FreshnessTracker, parse_page_args, parse_tail_args, parse_freshness_args, format_page
+
+# Replica server: one secondary of the replicated log. Every secondary runs this module; instances differ only
+# in their configuration, so any number of them can share a host, e.g.
+#   python replica.py --port 5003 --faults flaky --workers 8
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Replica server: one secondary of the replicated log')
+    parser.add_argument('--host', default=os.environ.get('REPLICA_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('REPLICA_PORT', 5001)))
+    parser.add_argument('--data-dir', default=os.environ.get('DATA_DIR'), help='store directory (default: replica_<port>_data)')
+    parser.add_argument('--faults', choices=PROFILES, default=os.environ.get('FAULT_PROFILE', 'none'),
+                        help='simulated fault profile; FAULT_DELAYS / FAULT_DROP_CHANCE override its values')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('REPLICA_WORKERS', 0)),
+                        help='request threads (default 0: a new thread per connection)')
+    parser.add_argument('--advertise-url', default=os.environ.get('ADVERTISE_URL', ''),
+                        help='URL the master reaches this replica at; set it to join the membership on start')
+    return parser.parse_args(argv)
+
+
+# Flags only when run as a script; a server that imports the module configures it through the environment
+config = parse_args(sys.argv[1:] if __name__ == '__main__' else [])
+
+app = Flask(__name__)
+
+# Structured logging: compact JSON lines written by a background thread, rotated by size
+setup_logging(f'replica_{config.port}.log')
+
+# Metrics served at GET /metrics
+metrics = Registry()
+batch_latency = metrics.histogram('replicate_batch_seconds', 'Time to store and acknowledge one /replicate_batch request, simulated delay included')
+persist_latency = metrics.histogram('persist_seconds', 'Time to write and fsync newly replicated entries')
+replicated = metrics.counter('replicated_entries_total', 'Replicated entries by result', ['result'])
+lock_wait = metrics.histogram('lock_wait_seconds', 'Time spent waiting to acquire a lock', ['lock'])
+metrics.callback('contiguous_id', 'Highest id up to which every entry is stored',
+                 'gauge', (), lambda: {(): replicated_messages.contiguous_id})
+metrics.callback('staleness_seconds', 'Time since the replica was last known to be as current as the master',
+                 'gauge', (), lambda: {(): freshness.staleness()})
+
+# Durable store: log segments plus periodic compact snapshots, recovered on restart
+store = SegmentStore(
+    config.data_dir or f'replica_{config.port}_data',
+    snapshot_every=int(os.environ.get('SNAPSHOT_EVERY', 100000))  # Entries between snapshots
+)
+
+# Replicated messages - id-ordered store that also deduplicates and tracks the highest contiguous id
+replicated_messages = ContiguousLog(store.recover())
+new_messages = TailNotifier(replicated_messages.contiguous_id)  # Wakes /messages/tail long-polls as the prefix grows
+freshness = FreshnessTracker(replicated_messages.contiguous_id)  # How far behind the master this replica is, for min_id / max_staleness reads
+replicated_messages_lock = TimedLock(lock_wait.labels('replicated_messages_lock'))  # Guards in-memory adds and reads only; never held across sleeps or disk I/O
+
+# Reads asking for a fresher replica wait up to read_wait seconds, then are sent to the master
+read_wait = float(os.environ.get('READ_WAIT', 0.5))
+master_url = os.environ.get('MASTER_URL', 'http://localhost:5000')  # Empty: answer 503 instead of redirecting
+
+# With an advertise URL set, the replica joins the master's membership on start and leaves on exit
+registration_interval = float(os.environ.get('REGISTRATION_INTERVAL', 30))  # Seconds between registration renewals
+
+# Simulated replication delays and missed requests, for testing retries and eventual consistency
+faults = FaultInjector.from_profile(config.faults)
+
+
+def snapshot_entries():
+    with replicated_messages_lock:
+        return replicated_messages.entries()
+
+
+def persist(entries):
+    """Write newly replicated entries to disk, then let acks and readers see them. Called without the messages lock."""
+    message_ids = [entry['id'] for entry in entries]
+    try:
+        with persist_latency.time():
+            store.append(entries)
+    except Exception:
+        with replicated_messages_lock:
+            replicated_messages.mark_unstored(message_ids)  # The master's retry stores them again
+        raise
+    with replicated_messages_lock:
+        replicated_messages.mark_durable(message_ids)
+        contiguous_id = replicated_messages.contiguous_id
+    new_messages.publish(contiguous_id)
+    freshness.advance(contiguous_id)
+    if store.snapshot_due():
+        store.snapshot(snapshot_entries)
+
+
+def note_master_contact():
+    """Record the master's last id carried by a batch or heartbeat."""
+    master_last_id = request.headers.get(wire.MASTER_LAST_ID, type=int)
+    if master_last_id is not None:
+        freshness.contact(master_last_id)
+
+
+def read_elsewhere(min_id, max_staleness):
+    """Answer a read this replica is not fresh enough for: a redirect to the same read on the master, or 503."""
+    staleness = freshness.staleness()
+    pretty_log("Replica too stale for read", log_type='debug', min_id=min_id, max_staleness=max_staleness,
+               contiguous_id=replicated_messages.contiguous_id, staleness=staleness)
+    if master_url:
+        return redirect(master_url + request.full_path, code=307)
+    return jsonify({'error': 'Replica is not caught up', 'contiguous_id': replicated_messages.contiguous_id,
+                    'staleness': staleness}), 503
+
+
+def parse_entry(data):
+    """The entry a replication request carries, or None unless it is an object with an id, a message and a timestamp."""
+    if not isinstance(data, dict):
+        return None
+    message_id = data.get('id')
+    message = data.get('message')
+    timestamp = data.get('timestamp')
+    # Ids index the contiguous log, so they must be positive integers
+    if not (message and timestamp and isinstance(message_id, int) and not isinstance(message_id, bool) and message_id > 0):
+        return None
+    return {
+        'id': message_id,
+        'message': message,
+        'timestamp': timestamp
+    }
+
+
+@app.route('/replicate', methods=['POST'])
+def replicate_message():
+    # Simulate network failure or unavailability (missed POST request)
+    if faults.should_drop():
+        pretty_log("Simulated network failure: POST request not received", log_type='error')
+        return jsonify({'status': 'POST request failed (simulated)'}), 500
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'status': 'Request body must be a JSON object'}), 400
+    replicated_message_entry = parse_entry(data)
+
+    if replicated_message_entry is not None:
+        message_id = replicated_message_entry['id']  # The message ID from the master
+        # Simulate delay for eventual consistency, before taking the lock so other requests and reads keep flowing
+        faults.delay()
+
+        # Deduplication and the in-memory append are the only work done under the lock
+        with replicated_messages_lock:
+            is_new = replicated_messages.add(replicated_message_entry)
+            is_durable = replicated_messages.is_durable(message_id)
+
+        if not is_new:
+            if not is_durable:
+                # Another request is still writing it; acking now could count an entry a crash would lose
+                pretty_log("Duplicate message not on disk yet", log_type='debug', message_id=message_id)
+                return jsonify({'status': 'Duplicate message not stored yet'}), 503
+            pretty_log("Duplicate message ignored", log_type='debug', message_id=message_id)
+            return jsonify({'status': 'Duplicate message ignored'}), 200
+
+        persist([replicated_message_entry])
+        replicated.labels('stored').inc()
+
+        # Log the replicated message
+        pretty_log("Message replicated", log_type='debug', message_id=message_id)
+        return jsonify({'status': 'Message replicated'}), 200
+
+    pretty_log('Invalid data provided for replication', log_type='warning')
+    return jsonify({'status': 'Invalid data provided'}), 400
+
+@app.route('/replicate_batch', methods=['POST'])
+def replicate_batch():
+    """Replicate a batch of messages from the master and acknowledge each stored id."""
+    received = time.perf_counter()
+    # Simulate network failure or unavailability (the whole batch is lost)
+    if faults.should_drop():
+        pretty_log("Simulated network failure: batch POST request not received", log_type='error')
+        return jsonify({'status': 'POST request failed (simulated)'}), 500
+
+    # The master may send the compact binary framing; anything else is the JSON {'messages': [...]} body
+    if request.mimetype == wire.BINARY:
+        try:
+            batch = wire.decode_batch(request.get_data())
+        except ValueError as e:
+            pretty_log("Malformed binary batch", log_type='warning', error=str(e))
+            return jsonify({'status': 'Invalid data provided'}), 400
+    else:
+        data = request.get_json(silent=True)
+        batch = data.get('messages', []) if isinstance(data, dict) else None
+        if not isinstance(batch, list):
+            return jsonify({'status': 'Request body must be a JSON object with a list of messages'}), 400
+    acks = []
+    stored = []
+
+    # Simulate delay for eventual consistency (once per batch), outside the lock
+    faults.delay()
+    note_master_contact()  # Before storing, so the batch's own entries can bring the replica up to date
+
+    entries = []
+    for data in batch:
+        entry = parse_entry(data)
+        if entry is None:
+            pretty_log("Invalid data in batch", log_type='warning', data=data)
+            continue
+        entries.append(entry)
+
+    with replicated_messages_lock:
+        for entry in entries:
+            if replicated_messages.add(entry):
+                stored.append(entry)
+            elif replicated_messages.is_durable(entry['id']):
+                # Duplicates are acknowledged too, so the master stops retrying them. One that another
+                # request is still writing is left out: that request acks it once it is on disk.
+                acks.append(entry['id'])
+
+    persist(stored)  # One write and fsync for the whole batch
+    acks.extend(entry['id'] for entry in stored)
+    replicated.labels('stored').inc(len(stored))
+    replicated.labels('duplicate').inc(len(entries) - len(stored))
+
+    pretty_log("Batch replicated", log_type='debug', acked=len(acks), stored=len(stored))
+    # The contiguous id lets the master track lag and spot gaps without a separate heartbeat
+    contiguous_id = replicated_messages.contiguous_id
+    batch_latency.observe(time.perf_counter() - received)
+    if request.accept_mimetypes.best_match([wire.JSON, wire.BINARY]) == wire.BINARY:
+        return app.response_class(wire.encode_acks(acks, contiguous_id), mimetype=wire.BINARY), 200
+    return jsonify({'status': 'Batch replicated', 'acks': acks, 'contiguous_id': contiguous_id}), 200
+
+@app.route('/messages', methods=['GET'])
+def get_messages():
+    """Return the contiguous prefix, optionally one page after a since_id cursor (limit, compact).
+
+    min_id (read-your-writes: the id a write returned) and max_staleness (seconds behind the master) ask
+    for a fresh enough replica; if it does not catch up within read_wait, the read goes to the master.
+    """
+    try:
+        since_id, limit, compact, paged = parse_page_args(request.args)
+        min_id, max_staleness = parse_freshness_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if (min_id or max_staleness is not None) and not freshness.wait_fresh(min_id, max_staleness, read_wait):
+        return read_elsewhere(min_id, max_staleness)
+
+    pretty_log("Replicated messages requested", log_type='debug', since_id=since_id, limit=limit)
+
+    # Only the contiguous prefix is visible, so a message is never shown before its predecessors
+    with replicated_messages_lock:
+        filtered_messages = replicated_messages.read(since_id, limit)
+
+    return jsonify(format_page(filtered_messages, since_id, compact, paged)), 200
+
+
+@app.route('/messages/tail', methods=['GET'])
+def tail_messages():
+    """Long-poll: return messages after since_id once the contiguous prefix passes it, or an empty page after timeout seconds."""
+    try:
+        since_id, limit, compact, timeout = parse_tail_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    new_messages.wait_for(since_id, timeout)
+    with replicated_messages_lock:
+        page = replicated_messages.read(since_id, limit)
+    return jsonify(format_page(page, since_id, compact, True)), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus scrape endpoint."""
+    return app.response_class(metrics.render(), content_type=CONTENT_TYPE)
+
+
+@app.route('/heartbeat', methods=['GET'])
+def heartbeat():
+    """Heartbeat endpoint to indicate the replica is healthy."""
+    note_master_contact()
+    pretty_log("Heartbeat received from master", log_type='debug', status="Healthy", contiguous_id=replicated_messages.contiguous_id)
+    return jsonify({'status': 'Healthy', 'contiguous_id': replicated_messages.contiguous_id}), 200
+
+
+registration = None  # Membership registration with the master, once started
+
+
+def start_background():
+    """Join the master's membership if an advertise URL is set. Called once in the serving process."""
+    global registration
+    if config.advertise_url and master_url:
+        registration = Registration(master_url, config.advertise_url, pretty_log, registration_interval)
+        registration.start()
+
+
+def stop_background():
+    """Leave the membership; for servers whose workers exit without running atexit handlers."""
+    if registration is not None:
+        registration.deregister()
+
+
+if __name__ == "__main__":
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"  # Keep-alive so the master can reuse pooled connections
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))  # Exit through atexit, so docker stop still deregisters
+    start_background()
+    pretty_log("Replica starting", port=config.port, faults=config.faults, workers=config.workers,
+               contiguous_id=replicated_messages.contiguous_id)
+    if config.workers > 0:
+        PooledWSGIServer(config.host, config.port, app, config.workers, handler=WSGIRequestHandler).serve_forever()
+    else:
+        app.run(host=config.host, port=config.port)
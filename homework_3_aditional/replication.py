@@ -0,0 +1,312 @@
+import asyncio
+import heapq
+import threading
+import time
+from collections import deque
+
+
+def run_callback(log, secondary_url, callback, *args):
+    """Call an ack or give-up callback. A failing callback is logged, so it cannot end the sender worker."""
+    try:
+        callback(*args)
+    except Exception as e:
+        log(f"Replication callback failed for {secondary_url}", log_type='error', error=repr(e))
+
+
+def take_batch(retry, pending, max_batch_size, now):
+    """Pop up to max_batch_size entries: due retries first, oldest and lowest id first, then fresh entries in order."""
+    batch = []
+    while retry and retry[0][0] <= now and len(batch) < max_batch_size:
+        batch.append(heapq.heappop(retry)[2])
+    while pending and len(batch) < max_batch_size:
+        batch.append(pending.popleft())
+    return batch
+
+
+class ReplicationSender:
+    """Per-secondary outbound queue that coalesces pending entries into batches and ships them in the background.
+
+    The queue holds at most max_pending entries; enqueue() blocks for up to enqueue_timeout when it is
+    full, which pushes back on the write path. Failed entries wait in one timer heap instead of a
+    sleeping thread each, and go out ahead of fresh entries once due. While the secondary is unreachable
+    the whole queue pauses until the retry is due, and the backlog is then drained in order and in full batches.
+    """
+
+    def __init__(self, secondary_url, send_batch, log, max_batch_size=100, max_linger=0.01, in_flight=2, retries=7,
+                 on_give_up=None, max_pending=10000, enqueue_timeout=1.0):
+        self.secondary_url = secondary_url
+        self.send_batch = send_batch  # callable(secondary_url, messages) -> set of acknowledged ids, None if unreachable
+        self.log = log
+        self.max_batch_size = max_batch_size
+        self.max_linger = max_linger  # How long to wait for more entries before sending a partial batch
+        self.in_flight = in_flight  # Number of batches that may be on the wire at the same time
+        self.retries = retries
+        self.on_give_up = on_give_up  # callable(secondary_url, message, on_ack) for entries out of retries
+        self.max_pending = max_pending  # Queue capacity in entries
+        self.enqueue_timeout = enqueue_timeout  # Seconds a writer waits for room before enqueue() gives up
+
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)  # Workers wait here for entries or the end of a pause
+        self.not_full = threading.Condition(self.lock)  # Writers wait here for room in the queue
+        self.pending = deque()  # Entries waiting to be sent: (message, on_ack, attempt)
+        self.retry = []  # Timer heap of failed entries: (due time, id, entry); due ones go out before pending
+        self.paused_until = 0.0  # While the secondary looks down, no batch leaves before this monotonic time
+        self.retried = 0  # Entries put back for another attempt, for /metrics
+        self.given_up = 0  # Entries handed to on_give_up
+        self.stopped = False  # Set by stop() when the secondary leaves the cluster
+        self.workers = []
+
+    def start(self):
+        """Start the sender workers. Each worker owns one in-flight batch."""
+        for i in range(self.in_flight):
+            t = threading.Thread(target=self._run, name=f"sender-{self.secondary_url}-{i}", daemon=True)
+            t.start()
+            self.workers.append(t)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.pending) + len(self.retry)
+
+    def stop(self):
+        """Drop the queued entries and let the workers exit after their current batch. Returns how many were dropped."""
+        with self.lock:
+            self.stopped = True
+            dropped = len(self.pending) + len(self.retry)
+            self.pending.clear()
+            self.retry.clear()
+            self.not_empty.notify_all()
+            self.not_full.notify_all()
+            return dropped
+
+    def enqueue(self, message, on_ack, timeout=None):
+        """Queue a message for replication. on_ack() is called once the secondary acknowledges it.
+
+        Returns False if the queue stayed full for enqueue_timeout seconds, or timeout if that is shorter
+        (what is left of the write's deadline); the message is not queued then.
+        """
+        wait = self.enqueue_timeout if timeout is None else min(self.enqueue_timeout, timeout)
+        with self.not_full:
+            if not self.not_full.wait_for(lambda: self.stopped or len(self.pending) < self.max_pending, wait):
+                return False
+            if self.stopped:
+                return False
+            self.pending.append((message, on_ack, 0))
+            self.not_empty.notify()
+            return True
+
+    def _due_retries(self, now):
+        return bool(self.retry) and self.retry[0][0] <= now
+
+    def _next_batch(self):
+        """Block until fresh or due entries are available and no pause is running, then linger briefly to fill the batch.
+
+        Returns None once the sender is stopped.
+        """
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                if self.stopped:
+                    return None
+                if self.paused_until > now:
+                    self.not_empty.wait(self.paused_until - now)
+                elif self.pending or self._due_retries(now):
+                    break
+                else:
+                    self.not_empty.wait(self.retry[0][0] - now if self.retry else None)
+
+            if not self._due_retries(now):  # A retry drain goes out right away; only fresh entries linger
+                deadline = now + self.max_linger
+                while len(self.pending) < self.max_batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.not_empty.wait(remaining)
+
+            batch = take_batch(self.retry, self.pending, self.max_batch_size, time.monotonic())
+            self.not_full.notify_all()
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            if not batch:
+                continue  # Another worker drained the queue while we were lingering
+
+            try:
+                acked = self.send_batch(self.secondary_url, [message for message, _, _ in batch])
+            except Exception as e:  # e.g. an undecodable ack: retry the batch like an unreachable secondary
+                self.log(f"Replication batch failed for {self.secondary_url}", log_type='error', error=repr(e),
+                         batch_size=len(batch))
+                acked = None
+            unreachable = acked is None
+            acked = acked or set()
+
+            failed = []
+            gave_up = 0
+            for message, on_ack, attempt in batch:
+                if message['id'] in acked:
+                    run_callback(self.log, self.secondary_url, on_ack)
+                elif attempt + 1 < self.retries:
+                    failed.append((message, on_ack, attempt + 1))
+                else:
+                    self.log(f"Replication gave up for {self.secondary_url}", log_type='error',
+                             message_id=message['id'], attempts=attempt + 1)
+                    gave_up += 1
+                    if self.on_give_up is not None:
+                        run_callback(self.log, self.secondary_url, self.on_give_up, self.secondary_url, message, on_ack)
+
+            if gave_up:
+                with self.lock:
+                    self.given_up += gave_up
+            if failed:
+                attempt = min(attempt for _, _, attempt in failed)
+                delay = 3 ** (attempt - 1)  # Exponential backoff
+                self.log(f"Retrying batch for {self.secondary_url}", log_type='warning',
+                         retrying=len(failed), first_id=failed[0][0]['id'], attempt=attempt, delay=delay)
+                with self.lock:
+                    self.retried += len(failed)
+                    due = time.monotonic() + delay
+                    for entry in failed:
+                        heapq.heappush(self.retry, (due, entry[0]['id'], entry))
+                    if unreachable:  # Nothing new can get through either: hold the queue until the retry is due
+                        self.paused_until = max(self.paused_until, due)
+                    self.not_empty.notify_all()
+
+
+class AsyncReplicationSender:
+    """Asyncio counterpart of ReplicationSender: the same bounded queue, retry timer and ordered drain on one event loop."""
+
+    def __init__(self, secondary_url, send_batch, log, max_batch_size=100, max_linger=0.01, in_flight=2, retries=7,
+                 on_give_up=None, max_pending=10000, enqueue_timeout=1.0):
+        self.secondary_url = secondary_url
+        self.send_batch = send_batch  # coroutine(secondary_url, messages) -> set of acknowledged ids, None if unreachable
+        self.log = log
+        self.max_batch_size = max_batch_size
+        self.max_linger = max_linger
+        self.in_flight = in_flight
+        self.retries = retries
+        self.on_give_up = on_give_up  # callable(secondary_url, message, on_ack) for entries out of retries
+        self.max_pending = max_pending
+        self.enqueue_timeout = enqueue_timeout
+
+        self.cond = asyncio.Condition()  # Created from the event loop, as senders are made lazily in handlers
+        self.pending = deque()  # Entries waiting to be sent: (message, on_ack, attempt)
+        self.retry = []  # Timer heap of failed entries: (due time, id, entry); due ones go out before pending
+        self.paused_until = 0.0  # While the secondary looks down, no batch leaves before this loop time
+        self.retried = 0  # Entries put back for another attempt, for /metrics
+        self.given_up = 0  # Entries handed to on_give_up
+        self.tasks = []
+
+    def start(self):
+        """Start the sender coroutines. Must be called from the running event loop."""
+        for _ in range(self.in_flight):
+            self.tasks.append(asyncio.create_task(self._run()))
+
+    def __len__(self):
+        return len(self.pending) + len(self.retry)
+
+    def stop(self):
+        """Drop the queued entries and cancel the sender coroutines, in-flight batches included. Returns how many were dropped."""
+        dropped = len(self.pending) + len(self.retry)
+        self.pending.clear()
+        self.retry.clear()
+        for task in self.tasks:
+            task.cancel()
+        return dropped
+
+    async def enqueue(self, message, on_ack, timeout=None):
+        """Queue a message for replication. on_ack() is called once the secondary acknowledges it.
+
+        Returns False if the queue stayed full for enqueue_timeout seconds, or timeout if that is shorter
+        (what is left of the write's deadline); the message is not queued then.
+        """
+        wait = self.enqueue_timeout if timeout is None else min(self.enqueue_timeout, timeout)
+        async with self.cond:
+            if len(self.pending) >= self.max_pending:  # wait_for() gives up at once on a zero timeout, even with room
+                try:
+                    await asyncio.wait_for(self.cond.wait_for(lambda: len(self.pending) < self.max_pending), wait)
+                except asyncio.TimeoutError:
+                    return False
+            self.pending.append((message, on_ack, 0))
+            self.cond.notify_all()
+            return True
+
+    async def _wait(self, timeout=None):
+        try:
+            await asyncio.wait_for(self.cond.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _due_retries(self, now):
+        return bool(self.retry) and self.retry[0][0] <= now
+
+    async def _next_batch(self):
+        """Wait until fresh or due entries are available and no pause is running, then linger briefly to fill the batch."""
+        loop = asyncio.get_running_loop()
+        async with self.cond:
+            while True:
+                now = loop.time()
+                if self.paused_until > now:
+                    await self._wait(self.paused_until - now)
+                elif self.pending or self._due_retries(now):
+                    break
+                else:
+                    await self._wait(self.retry[0][0] - now if self.retry else None)
+
+            if not self._due_retries(now):  # A retry drain goes out right away; only fresh entries linger
+                deadline = now + self.max_linger
+                while len(self.pending) < self.max_batch_size:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    await self._wait(remaining)
+
+            batch = take_batch(self.retry, self.pending, self.max_batch_size, loop.time())
+            self.cond.notify_all()
+            return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            if not batch:
+                continue
+            try:
+                acked = await self.send_batch(self.secondary_url, [message for message, _, _ in batch])
+            except Exception as e:  # e.g. an undecodable ack: retry the batch like an unreachable secondary
+                self.log(f"Replication batch failed for {self.secondary_url}", log_type='error', error=repr(e),
+                         batch_size=len(batch))
+                acked = None
+            unreachable = acked is None
+            acked = acked or set()
+
+            failed = []
+            gave_up = 0
+            for message, on_ack, attempt in batch:
+                if message['id'] in acked:
+                    run_callback(self.log, self.secondary_url, on_ack)
+                elif attempt + 1 < self.retries:
+                    failed.append((message, on_ack, attempt + 1))
+                else:
+                    self.log(f"Replication gave up for {self.secondary_url}", log_type='error',
+                             message_id=message['id'], attempts=attempt + 1)
+                    gave_up += 1
+                    if self.on_give_up is not None:
+                        run_callback(self.log, self.secondary_url, self.on_give_up, self.secondary_url, message, on_ack)
+
+            self.given_up += gave_up
+            if failed:
+                attempt = min(attempt for _, _, attempt in failed)
+                delay = 3 ** (attempt - 1)  # Exponential backoff
+                self.log(f"Retrying batch for {self.secondary_url}", log_type='warning',
+                         retrying=len(failed), first_id=failed[0][0]['id'], attempt=attempt, delay=delay)
+                self.retried += len(failed)
+                async with self.cond:
+                    due = loop.time() + delay
+                    for entry in failed:
+                        heapq.heappush(self.retry, (due, entry[0]['id'], entry))
+                    if unreachable:  # Nothing new can get through either: hold the queue until the retry is due
+                        self.paused_until = max(self.paused_until, due)
+                    self.cond.notify_all()
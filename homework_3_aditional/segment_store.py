@@ -0,0 +1,129 @@
+import json
+import os
+import re
+import threading
+from wal import encode_record, read_records, truncate_torn_tail
+
+SEGMENT_NAME = 'segment-{:08d}.log'
+SNAPSHOT_NAME = 'snapshot-{:08d}.json'
+FILE_PATTERN = re.compile(r'^(segment|snapshot)-(\d{8})\.(log|json)$')
+
+
+class SegmentStore:
+    """On-disk store for a secondary: append-only log segments plus periodic compact snapshots.
+
+    A snapshot named after segment N holds every entry written to segments below N, so recovery
+    loads the newest snapshot and replays only the segments from N onward.
+    """
+
+    def __init__(self, data_dir, segment_bytes=16 * 1024 * 1024, snapshot_every=100000, fsync=True):
+        self.data_dir = data_dir
+        self.segment_bytes = segment_bytes  # Roll to a new segment once the active one reaches this size
+        self.snapshot_every = snapshot_every  # Entries appended between snapshots
+        self.fsync = fsync
+
+        self.lock = threading.Lock()
+        self.segment_index = 0
+        self.segment = None
+        self.since_snapshot = 0
+        self.snapshotting = False
+
+    def _path(self, name):
+        return os.path.join(self.data_dir, name)
+
+    def _list(self, kind):
+        indexes = []
+        for name in os.listdir(self.data_dir):
+            match = FILE_PATTERN.match(name)
+            if match and match.group(1) == kind:
+                indexes.append(int(match.group(2)))
+        return sorted(indexes)
+
+    def recover(self):
+        """Load the newest snapshot plus the log tail and open a fresh segment. Returns the recovered entries."""
+        os.makedirs(self.data_dir, exist_ok=True)
+
+        entries = []
+        snapshots = self._list('snapshot')
+        base = 0
+        if snapshots:
+            base = snapshots[-1]
+            with open(self._path(SNAPSHOT_NAME.format(base))) as f:
+                entries = json.load(f)
+
+        # The snapshot may already hold entries that also reached the first tail segment
+        seen = {entry['id'] for entry in entries}
+        segments = [index for index in self._list('segment') if index >= base]
+        self.since_snapshot = 0
+        for index in segments:
+            path = self._path(SEGMENT_NAME.format(index))
+            tail, offset = read_records(path)
+            truncate_torn_tail(path, offset)
+            for entry in tail:
+                if entry['id'] not in seen:
+                    seen.add(entry['id'])
+                    entries.append(entry)
+                    self.since_snapshot += 1
+
+        self.segment_index = (segments[-1] if segments else base) + 1
+        self.segment = open(self._path(SEGMENT_NAME.format(self.segment_index)), 'ab')
+        return entries
+
+    def append(self, entries):
+        """Durably append a group of entries with a single write and fsync."""
+        if not entries:
+            return
+        data = b''.join(encode_record(entry) for entry in entries)
+        with self.lock:
+            self.segment.write(data)
+            self.segment.flush()
+            if self.fsync:
+                os.fsync(self.segment.fileno())
+            self.since_snapshot += len(entries)
+            if self.segment.tell() >= self.segment_bytes:
+                self._roll()
+
+    def _roll(self):
+        self.segment.close()
+        self.segment_index += 1
+        self.segment = open(self._path(SEGMENT_NAME.format(self.segment_index)), 'ab')
+
+    def snapshot_due(self):
+        return self.since_snapshot >= self.snapshot_every and not self.snapshotting
+
+    def snapshot(self, get_entries):
+        """Write a compact snapshot in the background and drop the segments it covers.
+
+        get_entries() must return a copy of the in-memory state. It is called right after the segment
+        roll, so it holds at least everything in the covered segments (callers update memory before
+        calling append()); overlap with the new segment is deduplicated on recovery.
+        """
+        with self.lock:
+            if self.snapshotting:
+                return
+            self.snapshotting = True
+            self._roll()
+            covered_upto = self.segment_index
+            self.since_snapshot = 0
+            entries = get_entries()
+        threading.Thread(target=self._write_snapshot, args=(entries, covered_upto), daemon=True).start()
+
+    def _write_snapshot(self, entries, covered_upto):
+        try:
+            path = self._path(SNAPSHOT_NAME.format(covered_upto))
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(sorted(entries, key=lambda entry: entry['id']), f, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)  # Atomic: recovery never sees a half-written snapshot
+
+            for index in self._list('segment'):
+                if index < covered_upto:
+                    os.remove(self._path(SEGMENT_NAME.format(index)))
+            for index in self._list('snapshot'):
+                if index < covered_upto:
+                    os.remove(self._path(SNAPSHOT_NAME.format(index)))
+        finally:
+            with self.lock:
+                self.snapshotting = False
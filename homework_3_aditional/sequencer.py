@@ -0,0 +1,21 @@
+import threading
+
+
+class Sequencer:
+    """Hands out strictly increasing message ids, one at a time or as a reserved range for a batch."""
+
+    def __init__(self, last_id=0):
+        self.last_id = last_id  # Highest id handed out so far
+        self.lock = threading.Lock()
+
+    def next_id(self):
+        return self.reserve(1)[0]
+
+    def reserve(self, count):
+        """Atomically reserve count consecutive ids and return them as a range."""
+        if count < 1:
+            raise ValueError('count must be >= 1')
+        with self.lock:
+            first = self.last_id + 1
+            self.last_id += count
+        return range(first, first + count)
@@ -0,0 +1,135 @@
+import argparse
+import importlib
+import importlib.util
+import os
+import signal
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import WSGIRequestHandler, ThreadedWSGIServer
+
+# Production serving entry point for every single-process node:
+#   python serving.py master [--threads 64]
+#   python serving.py replica --port 5002          (FAULT_PROFILE, DATA_DIR, ADVERTISE_URL configure the replica)
+#   python serving.py master_async                 (aiohttp, evented)
+# The Flask nodes run under gunicorn's gthread worker when gunicorn is installed, else under a pooled werkzeug server.
+# A node keeps its log, sequencer and replication state in process memory, so each runs as exactly one process:
+# concurrency comes from threads or the event loop. master_cluster.py is the multi-process master.
+NODES = {'master': 5000, 'replica': 5001, 'master_async': 5000}  # node module -> default port
+
+# Tuning shared by every server
+server_threads = int(os.environ.get('SERVER_THREADS', 32))  # Request threads of a Flask node
+server_backlog = int(os.environ.get('SERVER_BACKLOG', 2048))  # Pending connections the kernel queues before refusing
+server_keepalive = int(os.environ.get('SERVER_KEEPALIVE', 75))  # Seconds an idle keep-alive connection stays open
+
+
+def make_handler(keepalive=None):
+    """HTTP/1.1 request handler, so clients keep connections open, that drops a connection after keepalive idle seconds."""
+    class KeepAliveRequestHandler(WSGIRequestHandler):
+        protocol_version = "HTTP/1.1"
+        timeout = server_keepalive if keepalive is None else keepalive
+    return KeepAliveRequestHandler
+
+
+class PooledWSGIServer(ThreadedWSGIServer):
+    """werkzeug's threaded server with a fixed pool of request threads instead of a new thread per connection.
+
+    A keep-alive connection holds its thread until it closes or idles out, so workers should cover the
+    clients' pooled connections (the master's POOL_SIZE plus readers); further connections wait for a free thread.
+    """
+
+    def __init__(self, host, port, app, workers, handler=None, backlog=None, fd=None):
+        self.request_queue_size = server_backlog if backlog is None else backlog  # Read by listen() during __init__
+        super().__init__(host, port, app, handler=handler or make_handler(), fd=fd)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='request')
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+
+def load_node(node):
+    """Import a node module and start its background threads (heartbeats, membership renewal)."""
+    module = importlib.import_module(node)
+    module.start_background()
+    return module
+
+
+def stop_node(node):
+    """Stop what a node must stop before its process exits, e.g. a replica leaves the membership."""
+    module = sys.modules.get(node)
+    if module is not None and hasattr(module, 'stop_background'):
+        module.stop_background()
+
+
+def serve_gunicorn(node, host, port, threads, backlog, keepalive):
+    from gunicorn.app.base import BaseApplication
+
+    class NodeApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'{host}:{port}')
+            self.cfg.set('workers', 1)
+            self.cfg.set('worker_class', 'gthread')  # Idle keep-alive connections wait in a poller, not in a thread
+            self.cfg.set('threads', threads)
+            self.cfg.set('backlog', backlog)
+            self.cfg.set('keepalive', keepalive)
+            self.cfg.set('graceful_timeout', 10)
+            self.cfg.set('worker_exit', lambda arbiter, worker: stop_node(node))  # Workers skip atexit handlers
+            if 'control_socket_disable' in self.cfg.settings:
+                self.cfg.set('control_socket_disable', True)  # Newer gunicorn: nodes sharing a host would share one socket path
+
+        def load(self):
+            # Runs in the worker after the fork, so the node's log, locks and threads all live in the serving process
+            return load_node(node).app
+
+    NodeApplication().run()
+
+
+def serve_werkzeug(node, host, port, threads, backlog, keepalive):
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))  # Exit through atexit, so a replica deregisters
+    module = load_node(node)
+    PooledWSGIServer(host, port, module.app, threads, handler=make_handler(keepalive), backlog=backlog).serve_forever()
+
+
+def serve_aiohttp(node, host, port, backlog, keepalive):
+    from aiohttp import web
+    module = importlib.import_module(node)  # Its on_startup hook starts the heartbeats on the event loop
+    web.run_app(module.create_app(), host=host, port=port, backlog=backlog, keepalive_timeout=keepalive)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a node of the replicated log with a production server')
+    parser.add_argument('node', choices=NODES)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, help='default: 5000 for masters, REPLICA_PORT or 5001 for a replica')
+    parser.add_argument('--threads', type=int,
+                        help='request threads of a Flask node (default: REPLICA_WORKERS for a replica, else SERVER_THREADS)')
+    parser.add_argument('--backlog', type=int, default=server_backlog)
+    parser.add_argument('--keepalive', type=int, default=server_keepalive, help='idle keep-alive seconds')
+    parser.add_argument('--server', choices=['auto', 'gunicorn', 'werkzeug'], default=os.environ.get('SERVER', 'auto'),
+                        help='server for Flask nodes; auto prefers gunicorn')
+    args = parser.parse_args()
+
+    if args.node == 'replica':
+        # The replica names its data directory and log after its port, and reads it when imported
+        args.port = args.port or int(os.environ.get('REPLICA_PORT', NODES['replica']))
+        os.environ['REPLICA_PORT'] = str(args.port)
+    port = args.port or NODES[args.node]
+    if args.threads is None:
+        # replica.py's REPLICA_WORKERS still sizes a replica; its 0 (a thread per connection) means the shared default here
+        replica_workers = int(os.environ.get('REPLICA_WORKERS', 0)) if args.node == 'replica' else 0
+        args.threads = replica_workers or server_threads
+
+    if args.node == 'master_async':
+        serve_aiohttp(args.node, args.host, port, args.backlog, args.keepalive)
+        return
+    server = args.server
+    if server == 'auto':
+        server = 'gunicorn' if importlib.util.find_spec('gunicorn') else 'werkzeug'
+    if server == 'gunicorn':
+        sys.argv = sys.argv[:1]  # gunicorn parses the command line too; everything is configured above
+        serve_gunicorn(args.node, args.host, port, args.threads, args.backlog, args.keepalive)
+    else:
+        serve_werkzeug(args.node, args.host, port, args.threads, args.backlog, args.keepalive)
+
+
+if __name__ == '__main__':
+    main()
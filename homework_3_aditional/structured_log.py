@@ -0,0 +1,87 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LEVELS = {'debug': logging.DEBUG, 'info': logging.INFO, 'warning': logging.WARNING, 'error': logging.ERROR}
+
+logger = logging.getLogger()
+
+
+class JsonLineFormatter(logging.Formatter):
+    """One compact JSON object per line: time, level, event and the structured details."""
+
+    def format(self, record):
+        entry = {
+            'timestamp': datetime.fromtimestamp(record.created).isoformat(),
+            'level': record.levelname,
+            'event': record.getMessage()
+        }
+        details = getattr(record, 'details', None)
+        if details:
+            entry['details'] = details
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, separators=(',', ':'), default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps only a random fraction of debug and info records; warnings and errors always pass."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Hands records to the writer thread without formatting them, and drops them rather than block when the queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record  # Formatting happens on the listener thread
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(filename):
+    """Route every log record through an in-memory queue to a size-rotated file written by a background thread.
+
+    LOG_LEVEL, LOG_SAMPLE_RATE (fraction of debug/info records kept), LOG_MAX_BYTES, LOG_BACKUP_COUNT
+    and LOG_QUEUE_SIZE tune it.
+    """
+    file_handler = RotatingFileHandler(
+        filename,
+        maxBytes=int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024)),
+        backupCount=int(os.environ.get('LOG_BACKUP_COUNT', 5))
+    )
+    file_handler.setFormatter(JsonLineFormatter())
+
+    queue_handler = DroppingQueueHandler(queue.Queue(int(os.environ.get('LOG_QUEUE_SIZE', 10000))))
+    queue_handler.addFilter(SamplingFilter(float(os.environ.get('LOG_SAMPLE_RATE', 1.0))))
+
+    logger.handlers[:] = [queue_handler]
+    logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+
+    listener = QueueListener(queue_handler.queue, file_handler)
+    listener.start()
+    atexit.register(listener.stop)  # Flush whatever is still queued on a clean exit
+    return listener
+
+
+def pretty_log(msg, log_type='info', **kwargs):
+    """Structured log helper: queues one record with kwargs as its details."""
+    logger.log(LEVELS[log_type], msg, extra={'details': kwargs})
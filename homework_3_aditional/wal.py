@@ -0,0 +1,142 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+# Record layout: 4-byte payload length, 4-byte CRC32 of the payload, then the compact JSON payload
+RECORD_HEADER = struct.Struct('>II')
+
+
+def encode_record(entry):
+    """Frame one entry as a length-prefixed, checksummed record."""
+    payload = json.dumps(entry, separators=(',', ':')).encode()
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_records(path):
+    """Decode records from a file through mmap. Returns (entries, offset of the end of the last intact record)."""
+    entries = []
+    size = os.path.getsize(path)
+    offset = 0
+    if size:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            while offset + RECORD_HEADER.size <= size:
+                length, crc = RECORD_HEADER.unpack_from(mm, offset)
+                start = offset + RECORD_HEADER.size
+                end = start + length
+                if end > size:
+                    break
+                payload = mm[start:end]
+                if zlib.crc32(payload) != crc:
+                    break
+                entries.append(json.loads(payload))
+                offset = end
+    return entries, offset
+
+
+def truncate_torn_tail(path, offset):
+    """Drop a partially written record left behind by a crash."""
+    if offset < os.path.getsize(path):
+        with open(path, 'r+b') as f:
+            f.truncate(offset)
+
+
+class WriteAheadLog:
+    """Append-only, length-prefixed log with group commit: one fsync covers every append in the commit window."""
+
+    def __init__(self, path, log, commit_window=0.002, retry_delay=0.1):
+        self.path = path
+        self.log = log
+        self.commit_window = commit_window  # Seconds to let concurrent writers join a group before fsync
+        self.retry_delay = retry_delay  # Seconds to wait before retrying a group the disk refused
+        self.file = None
+
+        self.lock = threading.Lock()
+        self.pending_cond = threading.Condition(self.lock)  # Signals the flusher that records are buffered
+        self.durable_cond = threading.Condition(self.lock)  # Signals writers that their group was fsynced
+        self.appended = 0  # Records written to the file buffer
+        self.durable = 0  # Records known to be on disk
+        self.callbacks = []  # on_durable callbacks of the group being built
+        self.fsyncs = 0  # Groups committed, for /metrics
+
+    def open(self):
+        """Replay the existing log, reopen it for appending and start the flusher. Returns the replayed entries."""
+        entries = self.replay()
+        self.file = open(self.path, 'ab')
+        self.appended = self.durable = len(entries)
+        threading.Thread(target=self._flush_loop, name='wal-flusher', daemon=True).start()
+        return entries
+
+    def replay(self):
+        """Read every intact record. A torn or corrupt tail (crash mid-write) is truncated away."""
+        if not os.path.exists(self.path):
+            return []
+
+        entries, offset = read_records(self.path)
+        truncate_torn_tail(self.path, offset)
+        return entries
+
+    def append(self, entry, on_durable=None):
+        """Buffer one record. on_durable() runs on the flusher thread once the record's group is fsynced.
+
+        Returns the record's ticket for wait_durable().
+        """
+        record = encode_record(entry)
+        with self.lock:
+            self.file.write(record)
+            self.appended += 1
+            if on_durable is not None:
+                self.callbacks.append(on_durable)
+            self.pending_cond.notify()
+            return self.appended
+
+    def wait_durable(self, ticket, timeout=None):
+        """Block until the record returned by append() as ticket is on disk."""
+        with self.lock:
+            return self.durable_cond.wait_for(lambda: self.durable >= ticket, timeout)
+
+    def _flush_loop(self):
+        while True:
+            with self.lock:
+                while self.durable == self.appended:
+                    self.pending_cond.wait()
+
+            time.sleep(self.commit_window)  # Let concurrent writers join this group
+
+            with self.lock:
+                target = self.appended
+                callbacks, self.callbacks = self.callbacks, []
+                error = None
+                try:
+                    self.file.flush()
+                except Exception as e:
+                    error = e
+
+            if error is None:
+                try:
+                    # fsync outside the lock so writers keep buffering the next group meanwhile
+                    os.fsync(self.file.fileno())
+                except Exception as e:
+                    error = e
+
+            if error is not None:
+                # Nothing in the group counts as durable; it is retried together with whatever is appended meanwhile
+                self.log("WAL sync failed", log_type='error', error=repr(error), records=target - self.durable)
+                with self.lock:
+                    self.callbacks[:0] = callbacks
+                time.sleep(self.retry_delay)
+                continue
+
+            with self.lock:
+                self.durable = target
+                self.fsyncs += 1
+                self.durable_cond.notify_all()
+
+            for callback in callbacks:
+                try:
+                    callback()
+                except Exception as e:  # A failing callback must not stop the flusher, or no write is acked again
+                    self.log("WAL durable callback failed", log_type='error', error=repr(e))
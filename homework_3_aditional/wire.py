@@ -0,0 +1,82 @@
+import json
+import struct
+
+JSON = 'application/json'
+BINARY = 'application/x-replication-frames'  # Compact framing used between the master and secondaries
+MASTER_LAST_ID = 'X-Master-Last-Id'  # Header on batches and heartbeats: the master's last id when it sent them
+
+# Record: 8-byte id, 1-byte message kind, 2-byte timestamp length, 4-byte message length, then both payloads
+RECORD_HEADER = struct.Struct('>QBHI')
+TEXT, JSON_VALUE = 0, 1  # Message kinds: UTF-8 text, or any other JSON value (kept as compact JSON)
+
+# Ack list: the secondary's 8-byte contiguous id, a 4-byte count, then one 8-byte id per acknowledged message
+ACK_HEADER = struct.Struct('>QI')
+
+
+def encode_batch(entries):
+    """Frame a batch of entries as back-to-back length-prefixed records."""
+    parts = []
+    for entry in entries:
+        message = entry['message']
+        if isinstance(message, str):
+            kind, payload = TEXT, message.encode()
+        else:
+            kind, payload = JSON_VALUE, json.dumps(message, separators=(',', ':')).encode()
+        timestamp = entry['timestamp'].encode()
+        parts.append(RECORD_HEADER.pack(entry['id'], kind, len(timestamp), len(payload)))
+        parts.append(timestamp)
+        parts.append(payload)
+    return b''.join(parts)
+
+
+def decode_batch(data):
+    """Parse records produced by encode_batch(). Raises ValueError on a truncated or malformed body."""
+    entries = []
+    append = entries.append  # Local lookups: this loop runs once per replicated message
+    unpack = RECORD_HEADER.unpack_from
+    header_size = RECORD_HEADER.size
+    size = len(data)
+    offset = 0
+    try:
+        while offset < size:
+            message_id, kind, timestamp_length, message_length = unpack(data, offset)
+            timestamp_start = offset + header_size
+            message_start = timestamp_start + timestamp_length
+            offset = message_start + message_length
+            if offset > size:
+                raise ValueError('truncated record')
+            payload = data[message_start:offset].decode()
+            append({
+                'id': message_id,
+                'message': payload if kind == TEXT else json.loads(payload),
+                'timestamp': data[timestamp_start:message_start].decode()
+            })
+    except struct.error as e:
+        raise ValueError(str(e))
+    return entries
+
+
+def encode_acks(acks, contiguous_id=0):
+    return ACK_HEADER.pack(contiguous_id, len(acks)) + struct.pack(f'>{len(acks)}Q', *acks)
+
+
+def decode_acks(data):
+    """Returns (acknowledged ids, contiguous id of the secondary)."""
+    contiguous_id, count = ACK_HEADER.unpack_from(data)
+    return list(struct.unpack_from(f'>{count}Q', data, ACK_HEADER.size)), contiguous_id
+
+
+def encode_request(batch, binary):
+    """Body and headers for a /replicate_batch request in the binary framing or the JSON body."""
+    if binary:
+        return encode_batch(batch), {'Content-Type': BINARY, 'Accept': BINARY}
+    return json.dumps({'messages': batch}, separators=(',', ':')).encode(), {'Content-Type': JSON}
+
+
+def decode_ack_response(content_type, body):
+    """(set of acknowledged ids, contiguous id or None) from a /replicate_batch response in either format."""
+    if content_type.split(';')[0].strip() == BINARY:
+        acks, contiguous_id = decode_acks(body)
+        return set(acks), contiguous_id
+    data = json.loads(body)
+    return set(data.get('acks', [])), data.get('contiguous_id')